@@ -17,7 +17,11 @@ setup(
     url='https://github.com/alex-nuclearboy/cli-personal-assistant.git',
     entry_points={
         'console_scripts': [
-            'personal-assistant = src.main:main'
+            'personal-assistant = src.main:main',
+            'personal-assistant-server = src.server:main',
+            'personal-assistant-client = src.client:main',
+            'personal-assistant-books = src.books:main',
+            'personal-assistant-replay = src.replay:main'
         ],
     },
 )
@@ -0,0 +1,201 @@
+from array import array
+from datetime import date, timedelta
+import calendar
+import re
+
+# Days are numbered by their position in a leap year, so 29 February
+# has a place of its own: 1 January is 1, 31 December is 366
+DAY_NUMBERS = [[0] * 32 for _ in range(13)]
+for _month in range(1, 13):
+    for _day in range(1, calendar.monthrange(2000, _month)[1] + 1):
+        DAY_NUMBERS[_month][_day] = (
+            date(2000, _month, _day) - date(1999, 12, 31)).days
+LEAP_DAY = DAY_NUMBERS[2][29]
+# Longest window looked ahead: a year holds every birthday once
+MAX_DAYS = 366
+
+
+def parse_birthday(value):
+    """
+    Returns (day, month, year) of a birthday written as dd-mm-yyyy,
+    dd/mm/yyyy, dd mm yyyy or dd.mm.yyyy, or None if it is not a real date.
+    """
+    try:
+        day, month, year = map(int, re.split(r'[-/ .]', value.strip()))
+    except ValueError:
+        return None
+    if not 1 <= month <= 12 or not 1 <= day <= 31 \
+            or not DAY_NUMBERS[month][day]:
+        return None
+    return day, month, year
+
+
+def parse_days(number_of_days):
+    """
+    Reads how many days ahead to look, cut to MAX_DAYS. Raises
+    ValueError for a negative number or text that is not a number.
+    """
+    days = int(number_of_days)
+    if days < 0:
+        raise ValueError("The number of days cannot be negative.")
+    return min(days, MAX_DAYS)
+
+
+def days_in_year_from(today):
+    """Days from today up to the same date next year, not included."""
+    if (today.month, today.day) == (2, 29):
+        end = date(today.year + 1, 3, 1)
+    else:
+        end = today.replace(year=today.year + 1)
+    return (end - today).days
+
+
+class BirthdayIndex:
+    """
+    class for answering birthday questions about a whole address book
+
+    Birthdays are parsed once into compact integer columns (month, day,
+    year), one slot per contact, and every slot is also filed under its
+    day of the year. Digests then work on whole columns or on the few
+    days they ask about instead of parsing every contact's birthday.
+    """
+
+    def __init__(self):
+        self.months = array('B')
+        self.days = array('B')
+        self.years = array('H')
+        self.records = []       # Slot -> record, None for a free slot
+        self.values = []        # Slot -> birthday text it was parsed from
+        self.slots = {}         # Record -> slot
+        self.free = []          # Slots of removed contacts, for reuse
+        # Day of the year -> slots of contacts born on that day
+        self.by_day = [set() for _ in range(367)]
+        self.per_month = array('L', [0] * 13)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def update(self, record):
+        """Files the record's birthday, or removes it if it has none."""
+        value = record.birthday.value if record.birthday else None
+        slot = self.slots.get(record)
+        if slot is not None and self.values[slot] == value:
+            return
+        self.remove(record)
+        parsed = parse_birthday(value) if value else None
+        if parsed is None:
+            return
+        day, month, year = parsed
+        if self.free:
+            slot = self.free.pop()
+            self.months[slot], self.days[slot], self.years[slot] = \
+                month, day, year
+            self.records[slot], self.values[slot] = record, value
+        else:
+            slot = len(self.records)
+            self.months.append(month)
+            self.days.append(day)
+            self.years.append(year)
+            self.records.append(record)
+            self.values.append(value)
+        self.slots[record] = slot
+        self.by_day[DAY_NUMBERS[month][day]].add(slot)
+        self.per_month[month] += 1
+
+    def remove(self, record):
+        slot = self.slots.pop(record, None)
+        if slot is None:
+            return
+        month, day = self.months[slot], self.days[slot]
+        self.by_day[DAY_NUMBERS[month][day]].discard(slot)
+        self.per_month[month] -= 1
+        self.months[slot] = self.days[slot] = self.years[slot] = 0
+        self.records[slot] = self.values[slot] = None
+        self.free.append(slot)
+
+    def clear(self):
+        self.__init__()
+
+    def _slots_on(self, day):
+        slots = self.by_day[DAY_NUMBERS[day.month][day.day]]
+        if day.month == 2 and day.day == 28 \
+                and not calendar.isleap(day.year):
+            # Without 29 February, those birthdays are celebrated on the 28th
+            slots = slots | self.by_day[LEAP_DAY]
+        return slots
+
+    def digest(self, number_of_days, today=None):
+        """
+        Returns [(date, [(record, age)]), ...] for every day in the next
+        `number_of_days` days, starting today, that has birthdays. Age is
+        the age the contact turns on that day.
+        """
+        today = today or date.today()
+        result = []
+        # Past a year the same days would be visited again, and from
+        # 29 February the 28th next year is a leap birthday once more
+        seen = set()
+        for offset in range(min(parse_days(number_of_days),
+                                days_in_year_from(today))):
+            day = today + timedelta(days=offset)
+            slots = self._slots_on(day) - seen
+            seen |= slots
+            if slots:
+                result.append((day, [
+                    (self.records[slot], day.year - self.years[slot])
+                    for slot in sorted(slots)]))
+        return result
+
+    def upcoming(self, number_of_days, today=None):
+        """Returns the records with a birthday in the next days."""
+        return [record for _, people in self.digest(number_of_days, today)
+                for record, _ in people]
+
+    def in_order(self, today=None):
+        """
+        Yields (date, record) for every birthday in the year starting
+        today, soonest first and by name on the same day. Only the days
+        that are read are looked at, and the order rolls over to the
+        next day by itself.
+        """
+        today = today or date.today()
+        seen = set()
+        for offset in range(days_in_year_from(today)):
+            day = today + timedelta(days=offset)
+            slots = self._slots_on(day) - seen
+            seen |= slots
+            records = [self.records[slot] for slot in slots]
+            for record in sorted(records,
+                                 key=lambda record: record.name.value.lower()):
+                yield day, record
+
+    def month_histogram(self):
+        """Returns {month number: number of birthdays} for every month."""
+        return {month: self.per_month[month] for month in range(1, 13)}
+
+    def turning(self, age, today=None):
+        """
+        Returns [(date, record)] of contacts who turn `age` on their next
+        birthday, ordered by date. Works column-wise: the year of the next
+        birthday is worked out for the whole book in one pass over the
+        arrays, and only the matching slots are looked at afterwards.
+        """
+        today = today or date.today()
+        today_number = DAY_NUMBERS[today.month][today.day]
+        # Year of birth if the birthday is still ahead this year, or if
+        # it has already passed and the next one is next year
+        year_if_ahead, year_if_passed = today.year - age, today.year + 1 - age
+        matches = [
+            slot for slot, (month, day, year) in enumerate(
+                zip(self.months, self.days, self.years))
+            if month and year == (year_if_ahead
+                                  if DAY_NUMBERS[month][day] >= today_number
+                                  else year_if_passed)]
+        result = []
+        for slot in matches:
+            month, day = self.months[slot], self.days[slot]
+            year = self.years[slot] + age
+            if month == 2 and day == 29 and not calendar.isleap(year):
+                day = 28
+            result.append((date(year, month, day), self.records[slot]))
+        return sorted(result, key=lambda item: item[0])
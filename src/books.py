@@ -0,0 +1,243 @@
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import heapq
+import os
+import sys
+
+from src.birthdays import parse_days
+from src.classes import AddressBook, Notebook, ConsoleInterface
+from src.client import command_loop
+from src.main import CONTACT_COLUMNS, NOTE_COLUMNS
+from src.main import INTERFACES, OUTPUT_VARIABLE
+from src.server import note_to_response
+
+view = ConsoleInterface()
+
+# Columns put in front of the results of every book
+BOOK_COLUMN = ('book', "Book", 'white')
+ERROR_COLUMNS = [BOOK_COLUMN, ('error', "Error", 'red')]
+BIRTHDAY_COLUMNS = [('date', "Date", 'green'), BOOK_COLUMN,
+                    CONTACT_COLUMNS[0], ('age', "Turns", 'yellow')]
+
+# Books loaded by this worker process, by file name
+loaded_books = {}
+
+
+def load_book(filename):
+    """
+    Returns this process's (AddressBook, Notebook) for the file. The file
+    is loaded on first use; later calls only merge what was saved since.
+    """
+    books = loaded_books.get(filename)
+    if books is None:
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f"{filename} does not exist")
+        books = AddressBook(), Notebook()
+        # A damaged file fails the search of this book instead of
+        # being searched as an empty one
+        books[0].report = lambda message: None
+        books[0].load_from_disk(filename, books[1], strict=True)
+        loaded_books[filename] = books
+    else:
+        books[0].reload_if_changed(books[1])
+    return books
+
+
+def search_book(filename, op, query, k, statistics=None):
+    """
+    Runs one search on one book in a worker process. Returns a list of
+    (sort key, result) pairs with results as plain dictionaries.
+    """
+    address_book, notebook = load_book(filename)
+    if op == 'note_statistics':
+        return [(None, notebook.search_statistics(query))]
+    if op == 'search':
+        return [(record.name.value, record.to_dict())
+                for record in address_book.search_contacts(query)]
+    if op == 'search_by_birthday':
+        return [(day.isoformat(), dict(record.to_dict(), age=age,
+                                       date=day.isoformat()))
+                for day, people in address_book.birthday_digest(query)
+                for record, age in people]
+    if op == 'find_notes':
+        return [(score, dict(note_to_response(note), preview=note.preview))
+                for score, note in notebook.rank_notes(query, k, statistics)]
+    raise ValueError(f"Unknown operation: {op}")
+
+
+class BookSearch:
+    """
+    Searches many data files at once.
+
+    Every file is always sent to the same worker process, which keeps it
+    loaded between searches, and the workers search their files in
+    parallel. Results are merged and labelled with the file they came
+    from: contacts by name, birthdays by date, notes by score. Notes are
+    scored with the word statistics of all the books together, so their
+    scores can be compared.
+    """
+
+    def __init__(self, filenames, workers=None):
+        self.filenames = list(filenames)
+        workers = workers or min(len(self.filenames), os.cpu_count() or 1)
+        self.pools = [ProcessPoolExecutor(max_workers=1)
+                      for _ in range(max(workers, 1))]
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self, op, query, k=10, statistics=None):
+        """Returns ([(sort key, book, result)], {book: error})."""
+        futures = [
+            (filename, self.pools[i % len(self.pools)].submit(
+                search_book, filename, op, query, k, statistics))
+            for i, filename in enumerate(self.filenames)]
+        results, errors = [], {}
+        for filename, future in futures:
+            try:
+                results += [(key, filename, item)
+                            for key, item in future.result()]
+            except Exception as e:
+                errors[filename] = str(e)
+        return results, errors
+
+    def search_contacts(self, query):
+        results, errors = self._run('search', query)
+        return [item[1:] for item in sorted(
+            results, key=lambda item: (item[0].lower(), item[1]))], errors
+
+    def search_by_birthday(self, number_of_days):
+        results, errors = self._run('search_by_birthday',
+                                    parse_days(number_of_days))
+        return [item[1:] for item in sorted(
+            results, key=lambda item: item[:2])], errors
+
+    def find_notes(self, query, k=10):
+        found, errors = self._run('note_statistics', query)
+        count, total_lengths, document_count = 0, None, {}
+        for _, _, (notes, lengths, documents) in found:
+            count += notes
+            total_lengths = [a + b for a, b in
+                             zip(total_lengths or [0] * len(lengths), lengths)]
+            for word, number in documents.items():
+                document_count[word] = document_count.get(word, 0) + number
+        statistics = (count, total_lengths, document_count) if count \
+            else None
+        results, more_errors = self._run('find_notes', query, k, statistics)
+        errors.update(more_errors)
+        return [item[1:] for item in heapq.nlargest(
+            k, results, key=lambda item: item[0])], errors
+
+
+def book_name(filename):
+    return os.path.basename(filename)
+
+
+def show_results(title, columns, results):
+    """Shows (filename, result) pairs with the book each came from."""
+    view.display_table(title, columns,
+                       [dict(result, book=book_name(filename))
+                        for filename, result in results])
+
+
+def show_errors(errors):
+    if errors:
+        view.display_table(
+            "Could not search:", ERROR_COLUMNS,
+            [{'book': book_name(filename), 'error': error}
+             for filename, error in errors.items()])
+
+
+def book_commands(books):
+    """Builds the command table of the multi-book mode."""
+
+    def search():
+        query = view.ask(
+            "Please enter a part of the name or phone number: ").strip()
+        results, errors = books.search_contacts(query)
+        show_results(f"Found {len(results)} contacts in "
+                     f"{len(books.filenames)} books:",
+                     [BOOK_COLUMN, *CONTACT_COLUMNS], results)
+        show_errors(errors)
+        return ""
+
+    def search_by_birthday():
+        days = view.ask(
+            "Please enter the range for birthday search : ").strip()
+        results, errors = books.search_by_birthday(days)
+        show_results(f"Birthdays in the next {days} days:",
+                     BIRTHDAY_COLUMNS, results)
+        show_errors(errors)
+        return ""
+
+    def find_note():
+        query = view.ask("Please enter search query for notes "
+                         "(author, title, or content): ").strip()
+        results, errors = books.find_notes(query)
+        show_results(f"Best matching notes for '{query}':",
+                     [BOOK_COLUMN, *NOTE_COLUMNS], results)
+        show_errors(errors)
+        return ""
+
+    return {
+        "search by birthday": search_by_birthday,
+        "search": search,
+        "find note": find_note,
+    }
+
+
+def main():
+    """
+    Usage: personal-assistant-books <filename or pattern> ...
+    Opens every matching data file and searches them all at once.
+    """
+    filenames = sorted({filename for pattern in sys.argv[1:]
+                        for filename in (glob.glob(pattern) or [pattern])
+                        if not filename.endswith(('.lock', '.sock'))
+                        and '.notes.' not in filename})
+    if not filenames:
+        print("Usage: personal-assistant-books <filename or pattern> ...")
+        return
+    global view
+    output = os.environ.get(OUTPUT_VARIABLE, 'console').lower()
+    if output not in INTERFACES:
+        raise SystemExit(f"{OUTPUT_VARIABLE} should be one of: "
+                         + ', '.join(INTERFACES))
+    view = INTERFACES[output]()
+    exit_commands = ('good bye', 'close', 'exit', '.')
+    with BookSearch(filenames) as books:
+        commands = book_commands(books)
+        view.display_message(f"\nSearching {len(filenames)} books.\n"
+                             " Type 'help' to see available commands.")
+        def run(data):
+            data = data.lower()
+            if data in exit_commands:
+                view.display_message("Good bye!")
+                return True
+            if data == 'help':
+                view.display_command_help('\n'.join(commands))
+                return False
+            func = next((commands[command] for command in commands
+                         if data.startswith(command)), None)
+            if func is None:
+                view.display_message(
+                    "Unknown command: Type 'help' for available commands.")
+                return False
+            try:
+                view.display_message(func())
+            except ValueError as e:
+                view.display_message(f"Error: {str(e)}")
+            return False
+
+        command_loop(view, list(commands) + ['help', *exit_commands], run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from datetime import date
+import functools
+import threading
+
+from src.birthdays import parse_days
+
+# Most results kept per AddressBook or Notebook
+CACHE_SIZE = 128
+
+
+def normalize_text(query):
+    # 'Anna' and 'ANNA' are the same search; 'Anna ' is not
+    return str(query).lower()
+
+
+def fold_whitespace(query):
+    # For searches that split the query into words: 'a  b' is 'a b'
+    return ' '.join(str(query).lower().split())
+
+
+def exact_text(query):
+    # For searches that match the text as typed, case and spaces included
+    return str(query)
+
+
+def normalize_days(number_of_days):
+    # Birthday results also depend on the day they are asked on
+    return parse_days(number_of_days), date.today()
+
+
+class ResultCache:
+    """
+    class for remembering recent search results
+
+    A least recently used cache keyed by (operation, normalized query).
+    Every result is stamped with the generation of the book it was
+    computed from; the book bumps its generation on every change, and a
+    result from an older generation is never returned.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.results = OrderedDict()
+        self.generation = None  # Generation of the stored results
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, key, generation, compute):
+        """Returns the stored result for key or computes and stores it."""
+        with self.lock:
+            if generation != self.generation:
+                self.results.clear()
+                self.generation = generation
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return self.results[key]
+        result = compute()
+        with self.lock:
+            self.misses += 1
+            if generation == self.generation:
+                self.results[key] = result
+                if len(self.results) > self.size:
+                    self.results.popitem(last=False)
+        return result
+
+
+def key_part(value):
+    # Statistics passed to rank_notes are lists and dicts
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+def cached(normalize=normalize_text):
+    """
+    Makes a search method of AddressBook or Notebook answer repeated
+    queries from the instance's result cache. `normalize` turns the
+    query, the first argument, into its key; the other arguments are
+    keyed as given. The method must return a list; callers get a copy
+    they may change.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, query, *args, **kwargs):
+            key = (method.__name__, normalize(query),
+                   *map(key_part, args),
+                   *((name, key_part(value))
+                     for name, value in sorted(kwargs.items())))
+            return list(self.results.get(
+                key, self.generation,
+                lambda: method(self, query, *args, **kwargs)))
+        return wrapper
+    return decorator
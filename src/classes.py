@@ -1,8 +1,28 @@
 from datetime import datetime
 from collections import UserDict
+import itertools
+import threading
+import time
 from abc import ABC, abstractmethod
+import sys
+import textwrap
 import re
-import pickle
+import json
+import os
+from tabulate import tabulate
+from termcolor import colored
+from src.birthdays import BirthdayIndex, parse_days
+from src.storage import file_lock, file_signature, read_data_file
+from src.storage import read_version, write_data_file, SyncState
+from src.storage import BlobStore
+from src.search import NoteSearchIndex
+from src.completion import PrefixIndex
+from src.terms import TermIndex, address_terms, address_words
+from src.terms import email_parts, email_terms
+from src.cache import ResultCache, cached, exact_text, fold_whitespace
+from src.cache import normalize_days
+from src.tally import Tally, contact_facts, note_facts
+from src.history import CHECKPOINT_EVERY, make_delta, apply_delta
 
 class BasicInterface(ABC):
     """
@@ -36,6 +56,38 @@ class BasicInterface(ABC):
         """
         print(message)
 
+    @abstractmethod
+    def display_table(self, title, columns, rows):
+        """
+        An abstract method for displaying rows of results. `columns` is a
+        list of (key, heading, color) with an optional function that
+        formats the value for reading; every row is a dictionary and
+        a list value holds several items.
+        """
+        pass
+
+    @abstractmethod
+    def display_record(self, title, record):
+        """
+        An abstract method for displaying the fields of a single item,
+        given as a dictionary.
+        """
+        pass
+
+    @abstractmethod
+    def display_data(self, data):
+        """
+        An abstract method for displaying data meant for other programs,
+        such as 'stats json', as JSON.
+        """
+        pass
+
+    def ask(self, message):
+        """
+        Asks the user a question and returns the answer.
+        """
+        return input(message)
+
 
 class ConsoleInterface(BasicInterface):
     """
@@ -54,6 +106,91 @@ class ConsoleInterface(BasicInterface):
     def display_message(self, message):
         print(message)
 
+    @staticmethod
+    def format_cell(value, color, formatter=None):
+        if formatter is not None:
+            value = formatter(value)
+        elif isinstance(value, (list, tuple)):
+            value = ',\n'.join(map(str, value))
+        if value is None or value == '':
+            return ' '
+        return colored(value, color) if color else value
+
+    def display_table(self, title, columns, rows):
+        table_data = [[self.format_cell(row.get(column[0]), *column[2:])
+                       for column in columns] for row in rows]
+        headers = [colored(heading, color) if color else heading
+                   for _, heading, color, *_ in columns]
+        table = tabulate(table_data, headers=headers, tablefmt="fancy_grid")
+        print(f"{title}\n{table}" if title else table)
+
+    def display_record(self, title, record):
+        lines = [title]
+        for key, value in record.items():
+            label = key.replace('_', ' ').capitalize()
+            if isinstance(value, (list, tuple)):
+                value = ', '.join(map(str, value))
+            value = str(value)
+            if len(label) + len(value) + 2 > 79:
+                # Long text goes under its label, wrapped to the screen
+                lines.append(f"{label}:\n{textwrap.fill(value, width=79)}")
+            else:
+                lines.append(f"{label}: {value}")
+        print('\n'.join(lines) + '\n')
+
+    def display_data(self, data):
+        print(json.dumps(data, indent=2, ensure_ascii=False, default=str))
+
+
+class JsonLinesInterface(BasicInterface):
+    """
+    A class for output read by other programs: every result is written
+    as one JSON object on its own line, without colors or tables. Before
+    a line is read, a "question" object tells the other program that an
+    answer is expected and what it is for.
+    """
+
+    def __init__(self, file=None):
+        self.file = file  # sys.stdout at the time of writing if None
+        # Reminders and folder watchers write from their own threads
+        self.lock = threading.Lock()
+
+    def write(self, kind, **fields):
+        line = json.dumps(dict(type=kind, **fields), ensure_ascii=False,
+                          default=str)
+        with self.lock:
+            file = self.file or sys.stdout
+            file.write(line + '\n')
+            file.flush()
+
+    def display_contact_info(self, result):
+        self.write('contacts', text=result)
+
+    def display_note_info(self, result):
+        self.write('notes', text=result)
+
+    def display_command_help(self, commands):
+        self.write('help', text=commands)
+
+    def display_message(self, message):
+        if message:
+            self.write('message', text=message)
+
+    def display_table(self, title, columns, rows):
+        self.write('table', title=title.strip() if title else title,
+                   rows=list(rows))
+
+    def display_record(self, title, record):
+        self.write('record', title=title.strip() if title else title,
+                   record=record)
+
+    def display_data(self, data):
+        self.write('data', data=data)
+
+    def ask(self, message):
+        self.write('question', text=message.strip())
+        return input()
+
 
 class Field:
 
@@ -73,6 +210,28 @@ class Field:
     def _validate(self, value):
         pass
 
+    @classmethod
+    def trusted(cls, value):
+        """
+        Builds the field from a value that was validated when it was
+        saved, without validating it again.
+        """
+        field = cls.__new__(cls)
+        field.__value = value
+        return field
+
+    def verify(self):
+        # Raises ValueError if the value is not valid
+        self._validate(self.__value)
+
+    def __eq__(self, other):
+        if isinstance(other, Field):
+            return type(self) is type(other) and self.value == other.value
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((type(self), self.value))
+
     def __str__(self):
         return str(self.__value)
 
@@ -100,6 +259,48 @@ class Phone(Field):
                              "0991234567 or +380991234567")
         return f'{value} is valid phone number'
 
+    @Field.value.setter
+    def value(self, new_value):
+        Field.value.fset(self, new_value)
+        # The same number in E.164 form, whichever way it was typed
+        self.canonical = self.normalize(new_value)
+
+    @classmethod
+    def trusted(cls, value):
+        phone = super().trusted(value)
+        phone.canonical = cls.normalize(value)
+        return phone
+
+    @staticmethod
+    def normalize(value):
+        # Every valid number ends with the 9 digits after the leading 0:
+        # 0991234567, 80991234567 and +380991234567 are all +380991234567
+        return '+380' + value[-9:]
+
+    @staticmethod
+    def normalize_prefix(prefix):
+        """
+        Returns the start of the canonical form shared by all numbers
+        beginning with prefix: '067', '8067' and '+38067' give '+38067'.
+        """
+        digits = prefix.strip().lstrip('+')
+        if not digits.isdigit():
+            raise ValueError(f"{prefix} is not the start of a phone number.")
+        for start in ('380', '80', '0'):
+            if digits.startswith(start):
+                return '+38' + digits[len(start) - 1:]
+            if start.startswith(digits):
+                return '+38'  # Too short to tell, every number matches
+        raise ValueError(f"{prefix} is not the start of a phone number.")
+
+    def __eq__(self, other):
+        if isinstance(other, Phone):
+            return self.canonical == other.canonical
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.canonical)
+
 
 class Birthday(Field):
     """class for validating birthday field"""
@@ -162,11 +363,101 @@ class Note:
     def __init__(self, author, title, body, tags):
         self.author = Name(author)
         self.title = Title(title)
+        self.blobs = None  # BlobStore the body is kept in when saved
         self.body = body
         self.tags = tags if tags else []
         self.created_at = datetime.now()  # Time of note creation
+        # Revisions of the body, oldest first. Each one is a dict with
+        # 'at' (time), 'kind' ('full' text or 'delta' from the previous
+        # revision) and either 'data' in memory or 'ref' in the body file
+        self.history = []
+
+    @property
+    def body(self):
+        # A saved body stays on disk and is read each time it is needed
+        if self._body is None:
+            return self.blobs.read(self.body_ref)
+        return self._body
+
+    @body.setter
+    def body(self, new_body):
+        self._body = new_body
+        self.body_ref = None  # Not saved to the body file yet
+        self.preview = self.make_preview(new_body)
+
+    @staticmethod
+    def make_preview(body):
+        # The short text shown in note listings
+        return (body[:12] + '...') if len(body) > 15 else body
+
+    def __setstate__(self, state):
+        # Notes pickled before bodies were stored separately
+        if 'body' in state:
+            body = state.pop('body')
+            state.update(_body=body, body_ref=None, blobs=None,
+                         preview=self.make_preview(body), history=[])
+        self.__dict__.update(state)
+
+    def store_body(self, blobs, ref):
+        # The body is now saved at `ref`, so it can leave memory
+        self.blobs, self.body_ref, self._body = blobs, ref, None
+
+    def store_part(self, blobs, revision, ref):
+        # The body (revision None) or a revision is now saved at `ref`
+        if revision is None:
+            self.store_body(blobs, ref)
+        else:
+            revision['ref'], revision['data'] = ref, None
+            self.blobs = blobs
+
+    def load_parts(self):
+        # Brings the body and revisions into memory, to be saved elsewhere
+        self._body = self.body
+        self.body_ref = None
+        for revision in self.history:
+            revision['data'] = self.revision_data(revision)
+            revision['ref'] = None
+
+    @staticmethod
+    def encode_revision(revision):
+        if revision['kind'] == 'full':
+            return revision['data']
+        return json.dumps(revision['data'], ensure_ascii=False)
+
+    def revision_data(self, revision):
+        if revision['data'] is not None:
+            return revision['data']
+        raw = self.blobs.read(revision['ref'])
+        return raw if revision['kind'] == 'full' else json.loads(raw)
+
+    def revision_text(self, number):
+        """Rebuilds the body as it was at revision `number`."""
+        if not 0 <= number < len(self.history):
+            raise IndexError(f"Revision {number} does not exist")
+        start = max(i for i in range(number + 1)
+                    if self.history[i]['kind'] == 'full')
+        text = self.revision_data(self.history[start])
+        for revision in self.history[start + 1:number + 1]:
+            text = apply_delta(text, self.revision_data(revision))
+        return text
 
     def edit_note(self, new_body):
+        old_body = self.body
+        if new_body == old_body:
+            return
+        if not self.history:
+            # The first revision is the original text; a saved body
+            # is shared with it instead of being copied
+            self.history.append({
+                'at': self.created_at.isoformat(), 'kind': 'full',
+                'ref': self.body_ref,
+                'data': old_body if self.body_ref is None else None})
+        if len(self.history) % CHECKPOINT_EVERY == 0:
+            kind, data = 'full', new_body
+        else:
+            kind, data = 'delta', make_delta(old_body, new_body)
+        self.history.append({'at': datetime.now().isoformat(),
+                             'kind': kind, 'ref': None, 'data': data})
         self.body = new_body
 
     def edit_note_title(self, new_title):
@@ -178,14 +469,51 @@ class Note:
             'author': self.author.value,
             'title': self.title.value,
             'body': self.body,
-            'tags': self.tags
+            'tags': self.tags,
+            'created_at': self.created_at.isoformat()
         }
 
+    def to_snapshot(self):
+        # Like to_dict, but refers to a saved body instead of including it
+        if self.body_ref is None:
+            data = self.to_dict()
+        else:
+            data = {
+                'author': self.author.value,
+                'title': self.title.value,
+                'body_ref': self.body_ref,
+                'preview': self.preview,
+                'tags': self.tags,
+                'created_at': self.created_at.isoformat()
+            }
+        if self.history:
+            data['history'] = [
+                [revision['at'], revision['kind'], revision['ref']]
+                for revision in self.history]
+        return data
+
     @classmethod
-    def from_dict(cls, notes):
+    def from_dict(cls, notes, blobs=None, trusted=False):
         # Create a new Note instance from a dictionary
-        record = cls(notes['author'], notes['title'],
-                     notes['body'], notes['tags'])
+        body = notes['preview'] if 'body_ref' in notes else notes['body']
+        if trusted:
+            # Validated when it was saved, so the fields are not checked
+            record = cls.__new__(cls)
+            record.author = Name.trusted(notes['author'])
+            record.title = Title.trusted(notes['title'])
+            record.blobs = None
+            record.body = body
+            record.tags = notes['tags'] if notes['tags'] else []
+            record.created_at = datetime.now()
+        else:
+            record = cls(notes['author'], notes['title'], body, notes['tags'])
+        if 'body_ref' in notes:
+            record.store_body(blobs, notes['body_ref'])
+        if notes.get('created_at'):
+            record.created_at = datetime.fromisoformat(notes['created_at'])
+        record.history = [
+            {'at': at, 'kind': kind, 'ref': ref, 'data': None}
+            for at, kind, ref in notes.get('history', [])]
         return record
 
     def __str__(self):
@@ -198,23 +526,158 @@ class Note:
 class Notebook(UserDict):
     """class for managing a collection of notes"""
 
+    def __init__(self, *args, **kwargs):
+        self.dirty = False  # True if there are unsaved changes
+        self.blobs = None  # BlobStore holding the saved note bodies
+        # Built on the first search, then kept up to date on every change
+        self.search_index = None
+        self.titles = PrefixIndex()  # For completing note titles
+        # Notes, tags and authors counted for 'report'
+        self.tally = Tally(note_facts)
+        # Bumped on every change, so cached results are never stale
+        self.generation = 0
+        self.results = ResultCache()
+        super().__init__(*args, **kwargs)
+
+    def _index(self, note):
+        self.generation += 1
+        self.titles.add(note.title.value)
+        self.tally.update(note.title.value, note)
+        if self.search_index is not None:
+            self.search_index.add(note)
+
+    def _unindex(self, title):
+        self.generation += 1
+        self.titles.remove(title)
+        self.tally.remove(title)
+        if self.search_index is not None:
+            self.search_index.remove(title)
+
+    def _clear(self):
+        self.generation += 1
+        self.data.clear()
+        self.titles.clear()
+        self.tally.clear()
+        self.search_index = None
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def store_bodies(self):
+        """
+        Saves new and edited bodies and new revisions to the body file,
+        compacting it when needed, and returns the notes as snapshot
+        dictionaries.
+        """
+        notes = list(self.data.values())
+        for note in notes:
+            if note.blobs is not None and note.blobs is not self.blobs:
+                note.load_parts()  # Saving to another file
+        # Parts are (note, None) for a body, (note, revision) for revisions
+        parts = [(note, None) for note in notes]
+        parts += [(note, revision) for note in notes
+                  for revision in note.history]
+        unsaved = [(note, revision) for note, revision in parts
+                   if (note.body_ref if revision is None
+                       else revision['ref']) is None]
+        refs = self.blobs.append([
+            note.body if revision is None else note.encode_revision(revision)
+            for note, revision in unsaved])
+        for (note, revision), ref in zip(unsaved, refs):
+            note.store_part(self.blobs, revision, ref)
+        refs = self.blobs.compact([
+            note.body_ref if revision is None else revision['ref']
+            for note, revision in parts])
+        for (note, revision), ref in zip(parts, refs or ()):
+            note.store_part(self.blobs, revision, ref)
+        return [note.to_snapshot() for note in notes]
+
     def add_note(self, note):
         self.data[note.title.value] = note
+        self._index(note)
+        self.mark_dirty()
+
+    def edit_note(self, title, new_body):
+        self.data[title].edit_note(new_body)
+        self._index(self.data[title])
+        self.mark_dirty()
 
-    def find_notes(self, query):
-        query_lower = query.lower()
-        return [
-            note for note in self.data.values()
-            if query_lower in note.title.value.lower()
-            or query_lower in note.body.lower()
-            or query_lower in note.author.value.lower()]
+    def revert_note(self, title, number):
+        # Reverting is an edit too, so it can be undone the same way
+        note = self.data[title]
+        note.edit_note(note.revision_text(number))
+        self._index(note)
+        self.mark_dirty()
+
+    def find_notes(self, query, k=10):
+        """
+        Returns the k notes that best match the words of the query in
+        their title, tags, author or text, best first. A word that is not
+        in any note matches the words starting with it.
+        """
+        return [note for _, note in self.rank_notes(query, k)]
+
+    @cached(normalize=fold_whitespace)
+    def rank_notes(self, query, k=10, statistics=None):
+        """
+        Like find_notes, but returns (score, note) pairs. See
+        NoteSearchIndex.search for `statistics`.
+        """
+        return [(score, self.data[title]) for score, title in
+                self._search_index().search(query, k, statistics)]
+
+    def search_statistics(self, query):
+        return self._search_index().statistics(query)
+
+    def _search_index(self):
+        if self.search_index is None:
+            self.search_index = NoteSearchIndex()
+            for note in self.data.values():
+                self.search_index.add(note)
+        return self.search_index
+
+    def select_notes(self, query='', tags=()):
+        """
+        Returns all notes containing every word of the query and carrying
+        every tag, in title order. Candidates come from the search index,
+        so only the matching notes are looked at.
+        """
+        index = self._search_index()
+        titles = index.matching(query) if query.strip() else None
+        tags = [tag if tag.startswith('#') else '#' + tag for tag in tags]
+        for tag in tags:
+            tagged = index.tagged(tag)
+            titles = tagged if titles is None else titles & tagged
+        if titles is None:
+            titles = set(self.data)
+        notes = []
+        for title in sorted(titles):
+            note = self.data[title]
+            note_tags = note.tags.split(', ') \
+                if isinstance(note.tags, str) else note.tags
+            if all(tag in note_tags for tag in tags):
+                notes.append(note)
+        return notes
 
     def delete_note(self, title):
         if title in self.data:
             del self.data[title]
+            self._unindex(title)
+            self.mark_dirty()
             return True
         return False
 
+    def delete_notes(self, titles):
+        """Deletes all the notes in one pass. Returns how many there were."""
+        count = 0
+        for title in titles:
+            if self.data.pop(title, None) is not None:
+                self._unindex(title)
+                count += 1
+        if count:
+            self.mark_dirty()
+        return count
+
     def get_note(self, title):
         return self.data.get(title, None)
 
@@ -233,9 +696,12 @@ class Notebook(UserDict):
 
     def add_tags(self, title, new_tags):
         note = self.data[title]
-        current_tags = note.tags
+        current_tags = note.tags if isinstance(note.tags, str) \
+            else ', '.join(note.tags)
         updated_tags = self.tag_conversion(current_tags + ', ' + new_tags)
         note.tags = updated_tags
+        self._index(note)
+        self.mark_dirty()
 
     def sort_notes_by_tags(self):
         sorted_notes = sorted(
@@ -244,19 +710,33 @@ class Notebook(UserDict):
                               sorted(note.tags, key=lambda tag: tag[1:])))
         return sorted_notes
 
+    @cached(normalize=exact_text)
     def find_notes_by_tags(self, query):
         return [note for note in self.data.values() if query in note.tags]
 
     def remove_tags(self, title, tags_to_remove):
         if title in self.data:
-            current_tags = self.data[title].tags.split(', ')
+            tags = self.data[title].tags
+            current_tags = tags.split(', ') if isinstance(tags, str) else tags
             updated_tags = [
                 tag for tag in current_tags if tag not in tags_to_remove]
             self.data[title].tags = ', '.join(updated_tags)
+            self._index(self.data[title])
+            self.mark_dirty()
             return True
         return False
 
 
+def verify_fields(fields):
+    """Yields (field type, value, error) for every invalid field."""
+    for field in fields:
+        try:
+            field.verify()
+        except ValueError as e:
+            yield (type(field).__name__.lower(), field.value,
+                   str(e).splitlines()[0])
+
+
 class Record:
     def __init__(self, name, birthday=None):
         self.name = Name(name)
@@ -264,17 +744,26 @@ class Record:
         self.emails = []
         self.addresses = []
         self.birthday = Birthday(birthday) if birthday else None
+        self.book = None  # The AddressBook holding this record
+
+    def _changed(self):
+        # Lets the address book know that this record was modified
+        if self.book is not None:
+            self.book.record_changed(self)
 
     def add_phone(self, phone):
         self.phones.append(Phone(phone))
+        self._changed()
         return f'Number phone {phone} has been add'
 
     def add_email(self, email):
         self.emails.append(Email(email))
+        self._changed()
         return f'Email {email} has been add'
 
     def add_address(self, address):
         self.addresses.append(Address(address))
+        self._changed()
         return f'Address {address} has been add'
 
     def update_birthday(self, new_birthday):
@@ -282,12 +771,13 @@ class Record:
             self.birthday.value = new_birthday
         else:
             self.birthday = Birthday(new_birthday)
+        self._changed()
 
     def remove_phone(self, phone):
         tel = Phone(phone)
-        if tel.value in [item.value for item in self.phones]:
-            self.phones = [
-                item for item in self.phones if tel.value != item.value]
+        if tel in self.phones:
+            self.phones = [item for item in self.phones if tel != item]
+            self._changed()
             return (f'Number phone {phone} has been removed '
                     f'from contact {self.name.value}.')
         else:
@@ -295,16 +785,21 @@ class Record:
                     f'in contact {self.name.value}.')
 
     def edit_name(self, name_new):
+        if self.book is not None:
+            self.book.rename(self, Name(name_new).value)
         self.name.value = name_new
+        self._changed()
         return f'Name has been changed to {name_new}'
 
     def edit_phone(self, phone_old, phone_new):
         tel_new = Phone(phone_new)
+        tel_old = Phone(phone_old)
         for item in self.phones:
-            if phone_old == item.value:
+            if tel_old == item:
                 idx = self.phones.index(item)
                 self.phones.remove(item)
                 self.phones.insert(idx, tel_new)
+                self._changed()
                 return (f'Number phone {phone_old} has been changed '
                         f'to {tel_new.value}')
         raise ValueError("Phone number not found for changing")
@@ -314,6 +809,7 @@ class Record:
         if tel.value in [item.value for item in self.emails]:
             self.emails = [
                 item for item in self.emails if tel.value != item.value]
+            self._changed()
             return (f'Number email {email} has been removed '
                     f'from contact {self.name.value}.')
         else:
@@ -327,6 +823,7 @@ class Record:
                 idx = self.emails.index(item)
                 self.emails.remove(item)
                 self.emails.insert(idx, tel_new)
+                self._changed()
                 return (f'Number email {email_old} has been changed '
                         f'to {tel_new.value}')
         raise ValueError("Email number not found for changing")
@@ -336,6 +833,7 @@ class Record:
         if tel.value in [item.value for item in self.addresses]:
             self.addresses = [
                 item for item in self.addresses if tel.value != item.value]
+            self._changed()
             return (f'Number address {address} has been removed '
                     f'from contact {self.name.value}.')
         else:
@@ -349,14 +847,14 @@ class Record:
                 idx = self.addresses.index(item)
                 self.addresses.remove(item)
                 self.addresses.insert(idx, tel_new)
+                self._changed()
                 return (f'Number address {address_old} has been changed '
                         f'to {tel_new.value}')
         raise ValueError("Address number not found for changing")
 
     def find_phone(self, phone):
         tel = Phone(phone)
-        return next(
-            (item for item in self.phones if tel.value == item.value), None)
+        return next((item for item in self.phones if tel == item), None)
 
     def days_to_birthday(self):
         today = datetime.now()
@@ -386,7 +884,19 @@ class Record:
         }
 
     @classmethod
-    def from_dict(cls, data):
+    def from_dict(cls, data, trusted=False):
+        if trusted:
+            # Validated when it was saved, so the fields are not checked
+            record = cls.__new__(cls)
+            record.name = Name.trusted(data['name'])
+            record.phones = [Phone.trusted(phone) for phone in data['phones']]
+            record.emails = [Email.trusted(email) for email in data['emails']]
+            record.addresses = [
+                Address.trusted(address) for address in data['addresses']]
+            record.birthday = Birthday.trusted(data['birthday']) \
+                if data['birthday'] else None
+            record.book = None
+            return record
         record = cls(name=data['name'], birthday=data['birthday'])
         for phone in data['phones']:
             record.add_phone(phone)
@@ -403,8 +913,109 @@ class Record:
              addresses: {'; '.join(a.value for a in self.addresses)}"
 
 
+# Orders of AddressBook.sorted_contacts
+CONTACT_ORDERS = ('name', 'birthday')
+
+
 class AddressBook(UserDict):
 
+    def __init__(self, *args, **kwargs):
+        self.sync = None  # State of the data file we last synced with
+        self.dirty = False  # True if there are unsaved changes
+        # Held while the book is being modified or saved
+        self.lock = threading.RLock()
+        # Canonical phone number -> set of records that have it
+        self.phone_index = {}
+        self._indexed_phones = {}  # Record -> its numbers in phone_index
+        self.phone_numbers = PrefixIndex()  # The keys of phone_index
+        self.birthdays = BirthdayIndex()
+        # Email local parts and domains, and the words of addresses
+        self.emails = TermIndex(email_terms)
+        self.addresses = TermIndex(address_terms)
+        self.names = PrefixIndex()  # For completing and finding names
+        # Contacts and their details counted for 'report'
+        self.tally = Tally(contact_facts)
+        self.reminders = None  # ReminderScheduler of the session, if any
+        self.report = print  # Where loading and saving messages go
+        # Durations of the last load and save, shown by 'stats'
+        self.timings = {}
+        # Bumped on every change, so cached results are never stale
+        self.generation = 0
+        self.results = ResultCache()
+        super().__init__(*args, **kwargs)
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def record_changed(self, record):
+        self._index(record)
+        self.mark_dirty()
+
+    def _index(self, record):
+        self.generation += 1
+        phones = {phone.canonical for phone in record.phones}
+        indexed = self._indexed_phones.get(record, set())
+        self._drop_phones(record, indexed - phones)
+        for phone in phones - indexed:
+            if phone not in self.phone_index:
+                self.phone_index[phone] = set()
+                self.phone_numbers.add(phone)
+            self.phone_index[phone].add(record)
+        self._indexed_phones[record] = phones
+        self.birthdays.update(record)
+        self.emails.update(record)
+        self.addresses.update(record)
+        self.tally.update(record, record)
+        if self.reminders is not None:
+            self.reminders.update(record)
+
+    def _unindex(self, record):
+        self.generation += 1
+        self._drop_phones(record, self._indexed_phones.pop(record, ()))
+        self.birthdays.remove(record)
+        self.emails.remove(record)
+        self.addresses.remove(record)
+        self.tally.remove(record)
+        if self.reminders is not None:
+            self.reminders.remove(record)
+
+    def _drop_phones(self, record, phones):
+        for phone in phones:
+            owners = self.phone_index[phone]
+            owners.discard(record)
+            if not owners:
+                del self.phone_index[phone]
+                self.phone_numbers.remove(phone)
+
+    def _attach(self, key, record):
+        record.book = self
+        self.data[key] = record
+        self.names.add(key)
+        self._index(record)
+
+    def _detach(self, key):
+        record = self.data.pop(key)
+        self.names.remove(key)
+        self._unindex(record)
+        record.book = None
+        return record
+
+    def _clear(self):
+        self.generation += 1
+        for record in self.data.values():
+            record.book = None
+        self.data.clear()
+        self.names.clear()
+        self.phone_index.clear()
+        self.phone_numbers.clear()
+        self._indexed_phones.clear()
+        self.birthdays.clear()
+        self.emails.clear()
+        self.addresses.clear()
+        self.tally.clear()
+        if self.reminders is not None:
+            self.reminders.clear()
+
     def add_record(self, obj):
         key = str(obj.name)
         if key in self.data:
@@ -414,80 +1025,330 @@ class AddressBook(UserDict):
                     existing_record.phones.append(phone)
             if obj.birthday:
                 existing_record.birthday = obj.birthday
-            print(f"Information added to existing contact: {key}")
+            existing_record._changed()
+            self.report(f"Information added to existing contact: {key}")
         else:
-            self.data[key] = obj
+            self._attach(key, obj)
+            self.mark_dirty()
 
     def find(self, name):
-        for record in self.data.values():
-            if name.lower() == record.name.value.lower():
-                return record
-        return None
+        key = name if name in self.data else self.names.lookup(name)
+        return self.data.get(key) if key is not None else None
+
+    def rename(self, record, new_name):
+        """Files the record under its new name before it is renamed."""
+        old_name = record.name.value
+        if new_name == old_name or self.data.get(old_name) is not record:
+            return
+        if new_name in self.data:
+            raise ValueError(f"Contact {new_name} already exists")
+        self._detach(old_name)
+        self._attach(new_name, record)
+        self.mark_dirty()
 
     def clear_all_contacts(self):
-        yes_no = input('Are you sure you want to delete all users? '
-                       '(y/n) ').lower().strip()
-        if yes_no == 'y':
-            self.data.clear()
-            return "All contacts cleared."
-        else:
-            return 'Removal canceled'
+        self._clear()
+        self.mark_dirty()
+        return "All contacts cleared."
 
     def delete(self, name):
         if name in self.data:
-            del self.data[name]
+            self._detach(name)
+            self.mark_dirty()
         else:
             raise KeyError(f'{name} not found')
 
-    def iterator(self, n=4):
-        for i in range(0, len(self.data), n):
-            yield list(self.data.values())[i:i + n]
+    def contacts_in_order(self, order='name'):
+        """
+        Returns an iterator over the contacts sorted by name, or by next
+        birthday with the contacts without one last. Both orders are kept
+        by the indexes and the birthday order is read one day at a time,
+        so reading it page by page costs about as much as the rows read.
+        """
+        if order not in CONTACT_ORDERS:
+            raise ValueError(f"Cannot sort contacts by {order}. "
+                             f"Use {' or '.join(CONTACT_ORDERS)}.")
+        names = (self.data.get(name) for name in self.names.names_from())
+        if order == 'name':
+            return (record for record in names if record is not None)
+        by_birthday = (record for _, record in self.birthdays.in_order())
+        without = (record for record in names if record is not None
+                   and record not in self.birthdays.slots)
+        return itertools.chain(by_birthday, without)
+
+    def sorted_contacts(self, order='name', start=0, count=None):
+        """
+        Returns `count` contacts (all if None) from position `start` of
+        the book in the order of contacts_in_order(). By name only the
+        rows returned are read; by birthday the rows before `start` are
+        walked as well, so go through the book with contacts_in_order().
+        """
+        if order == 'name':
+            return [self.data[name]
+                    for name in self.names.page(start, count)]
+        end = None if count is None else start + count
+        return list(itertools.islice(self.contacts_in_order(order),
+                                     start, end))
+
+    def iterator(self, n=4, order='name'):
+        contacts = self.contacts_in_order(order)
+        while True:
+            page = list(itertools.islice(contacts, n))
+            if not page:
+                return
+            yield page
 
     def save_to_disk(self, filename, notebook):
-        data = {
-            'contacts': [record.to_dict() for record in self.data.values()],
-            'notes': notebook.data
-        }
+        started = time.perf_counter()
         try:
-            with open(filename, 'wb+') as file:
-                pickle.dump(data, file)
+            with self.lock, file_lock(filename):
+                if self.sync is None or self.sync.filename != filename:
+                    self.sync = SyncState(filename)
+                if read_version(filename) > self.sync.version:
+                    # Another process saved since we last synced:
+                    # take its changes first so they are not lost
+                    self._merge_data(*read_data_file(filename), notebook)
+                if notebook.blobs is None \
+                        or notebook.blobs.filename != filename:
+                    notebook.blobs = BlobStore(filename)
+                contacts = [record.to_dict() for record in self.data.values()]
+                notes = notebook.store_bodies()
+                data = {
+                    'contacts': contacts,
+                    'notes': notes
+                }
+                write_data_file(filename, self.sync.version + 1, data)
+                self.dirty = notebook.dirty = False
+                self.sync.version += 1
+                self.sync.signature = file_signature(filename)
+                self.sync.contacts = {
+                    contact['name']: contact for contact in contacts}
+                self.sync.notes = {note['title']: note for note in notes}
+            self.timings['save_seconds'] = time.perf_counter() - started
+            self.timings['saves'] = self.timings.get('saves', 0) + 1
         except FileNotFoundError:
-            print(f"Error: The specified directory or file '{filename}' "
-                  "does not exist.")
+            self.report(f"Error: The specified directory or file "
+                        f"'{filename}' does not exist.")
         except Exception as e:
-            print(f"Error saving data to '{filename}': {str(e)}")
+            self.report(f"Error saving data to '{filename}': {str(e)}")
 
-    def load_from_disk(self, filename, notebook):
+    def load_from_disk(self, filename, notebook, strict=False):
+        """
+        Loads the data file. A file that cannot be read is reported and
+        the book is left empty, or with `strict` the error is raised.
+        """
+        self.sync = SyncState(filename)
+        notebook.blobs = BlobStore(filename)
+        started = time.perf_counter()
         try:
-            with open(filename, 'rb+') as file:
-                print(f"\nReading data from {filename}")
-                data = pickle.load(file)
-                self.data.clear()  # Clear existing data
-                notebook.data.clear()
-                for record_data in data.get('contacts', []):  # Load contact
-                    record = Record.from_dict(record_data)
-                    self.data[str(record.name)] = record
-                notebook.data.update(data.get('notes', {}))  # Load notes data
+            with self.lock, file_lock(filename):
+                version, data = read_data_file(filename)
+                self.report(f"\nReading data from {filename}")
+                self._clear()  # Clear existing data
+                notebook._clear()
+                self._merge_data(version, data, notebook)
+            self.timings['load_seconds'] = time.perf_counter() - started
         except FileNotFoundError:
-            print("File not found. Creating a new file.")
+            self.report("File not found. Creating a new file.")
         except Exception as e:
-            print(f"Error loading data: {str(e)}")
+            if strict:
+                raise
+            self.report(f"Error loading data: {str(e)}")
+
+    def reload_if_changed(self, notebook):
+        """
+        Merges changes another process has saved to the data file since
+        our last load or save. Returns True if the file had changed.
+        """
+        if self.sync is None:
+            return False
+        filename = self.sync.filename
+        if file_signature(filename) == self.sync.signature:
+            return False
+        try:
+            with self.lock, file_lock(filename):
+                self._merge_data(*read_data_file(filename), notebook)
+        except FileNotFoundError:
+            self.sync.signature = None
+        return True
+
+    def _merge_data(self, version, data, notebook):
+        """
+        Applies the records and notes that changed on disk since the last
+        sync. Only changed entries are rebuilt; entries that were also
+        changed locally keep the local version, which wins on next save.
+        """
+        sync = self.sync
+        # Snapshots marked as validated are loaded without checking
+        # every field again; 'verify' checks them on request
+        trusted = data.get('validated', False)
+        contacts = {
+            contact['name']: contact for contact in data.get('contacts', [])}
+        for key in set(sync.contacts) | set(contacts):
+            theirs, old = contacts.get(key), sync.contacts.get(key)
+            if theirs == old:
+                continue
+            local = self.data.get(key)
+            if (local.to_dict() if local else None) != old:
+                continue
+            if theirs is None:
+                self._detach(key)
+            else:
+                if key in self.data:
+                    self._detach(key)
+                self._attach(key, Record.from_dict(theirs, trusted))
+        notes = {note['title']: note for note in data.get('notes', [])}
+        for title in set(sync.notes) | set(notes):
+            theirs, old = notes.get(title), sync.notes.get(title)
+            if theirs == old:
+                continue
+            local = notebook.data.get(title)
+            if (local.to_snapshot() if local else None) != old:
+                continue
+            if theirs is None:
+                del notebook.data[title]
+                notebook._unindex(title)
+            else:
+                notebook.data[title] = Note.from_dict(
+                    theirs, notebook.blobs, trusted)
+                notebook._index(notebook.data[title])
+        sync.version = version
+        sync.signature = file_signature(sync.filename)
+        sync.contacts = contacts
+        sync.notes = notes
+
+    def verify(self, notebook):
+        """
+        Checks the data file's checksums and validates every field of
+        every contact and note. Returns a list of problems as
+        (contact or note, field, value, error) tuples.
+        """
+        problems = []
+        if self.sync is not None and os.path.exists(self.sync.filename):
+            try:
+                with file_lock(self.sync.filename):
+                    read_data_file(self.sync.filename)
+            except ValueError as e:
+                problems.append((self.sync.filename, 'file', '', str(e)))
+        for record in self.data.values():
+            fields = [record.name, *record.phones, *record.emails,
+                      *record.addresses]
+            if record.birthday:
+                fields.append(record.birthday)
+            problems += [(record.name.value, *problem)
+                         for problem in verify_fields(fields)]
+        for note in notebook.data.values():
+            problems += [(note.title.value, *problem)
+                         for problem in verify_fields([note.author,
+                                                       note.title])]
+        return problems
+
+    def find_by_phone(self, phone):
+        """
+        Returns the contacts that own the number, whichever format
+        it is written in. Raises ValueError for an invalid number.
+        """
+        return list(self.phone_index.get(Phone(phone).canonical, ()))
 
+    def select_contacts(self, name_prefix=None, phone_prefix=None):
+        """
+        Returns the contacts whose name starts with name_prefix (ignoring
+        case) or that have a number starting with phone_prefix, found
+        through the name and phone indexes. Raises ValueError for
+        a phone prefix that no number can start with.
+        """
+        if phone_prefix is not None:
+            prefix = Phone.normalize_prefix(phone_prefix)
+            records = {}
+            for number in self.phone_numbers.starting_with(prefix, None):
+                for record in self.phone_index[number]:
+                    records[record.name.value] = record
+            return [records[name] for name in sorted(records)]
+        return [self.data[name]
+                for name in self.names.starting_with(name_prefix or '', None)]
+
+    def delete_contacts(self, records):
+        """Deletes all the contacts in one pass. Returns how many."""
+        count = 0
+        for record in records:
+            if self.data.get(record.name.value) is record:
+                self._detach(record.name.value)
+                count += 1
+        if count:
+            self.mark_dirty()
+        return count
+
+    def remove_phones(self, phone_prefix):
+        """
+        Removes every number starting with phone_prefix from every
+        contact. Returns the number of contacts that lost a number.
+        """
+        prefix = Phone.normalize_prefix(phone_prefix)
+        records = self.select_contacts(phone_prefix=phone_prefix)
+        for record in records:
+            record.phones = [phone for phone in record.phones
+                             if not phone.canonical.startswith(prefix)]
+            record._changed()
+        return len(records)
+
+    def find_by_email(self, query):
+        """
+        Returns the contacts with an email matching the query, sorted by
+        name: '@corp.ua' matches the domain, 'anna@' the local part and
+        'anna@corp.ua' the whole address. Text without '@' is a local part.
+        """
+        local, domain = email_parts(query)
+        if '@' not in query:
+            local, domain = domain, ''
+        if local and domain:
+            terms = [('address', f"{local}@{domain}")]
+        else:
+            terms = [term for term in (('local', local), ('domain', domain))
+                     if term[1]]
+        return sorted(self.emails.find(*terms),
+                      key=lambda record: record.name.value)
+
+    def find_by_address(self, query):
+        """
+        Returns the contacts with an address containing every word of the
+        query, sorted by name.
+        """
+        return sorted(self.addresses.find(*address_words(query)),
+                      key=lambda record: record.name.value)
+
+    def count_by_domain(self):
+        """Returns (domain, number of contacts), most contacts first."""
+        counts = [(term[1], len(records))
+                  for term, records in self.emails.records.items()
+                  if term[0] == 'domain']
+        return sorted(counts, key=lambda item: (-item[1], item[0]))
+
+    @cached()
     def search_contacts(self, query):
-        results = []
         query = query.lower()
+        # 'email:@corp.ua' and 'address:Khreshchatyk' use their indexes
+        scope, colon, value = query.partition(':')
+        scopes = {'email': self.find_by_email,
+                  'address': self.find_by_address}
+        if colon and scope.strip() in scopes:
+            return scopes[scope.strip()](value.strip())
+        try:
+            return self.find_by_phone(query)  # A complete phone number
+        except ValueError:
+            pass
+        results = []
         for record in self.data.values():
             if (
                 query in record.name.value.lower() or
-                any(query in phone.value for phone in record.phones)
+                any(query in phone.value or query in phone.canonical
+                    for phone in record.phones)
             ):
                 results.append(record)
         return results
 
+    @cached(normalize=normalize_days)
     def search_by_birthday(self, number_of_days):
-        self._contact = []
-        for i in self.data.values():
-            self._birth_date = i.days_to_birthday()
-            if int(number_of_days) > self._birth_date:
-                self._contact.append(i)
-        return self._contact
+        return self.birthdays.upcoming(parse_days(number_of_days))
+
+    def birthday_digest(self, number_of_days):
+        return self.birthdays.digest(parse_days(number_of_days))
@@ -0,0 +1,154 @@
+import json
+import os
+import socket
+import sys
+
+from prompt_toolkit import PromptSession
+from prompt_toolkit.completion import WordCompleter
+
+from src.classes import ConsoleInterface
+
+
+class AssistantClient:
+    """
+    A thin client for AssistantServer: sends one JSON request per line
+    over the Unix socket and returns the decoded result.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.stream = self.sock.makefile('rwb')
+
+    def request(self, op, **args):
+        self.stream.write(
+            json.dumps({'op': op, 'args': args}).encode() + b'\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+def default_socket_path(filename):
+    """Returns the Unix socket path used to serve the given data file."""
+    return os.path.abspath(filename) + '.sock'
+
+
+def connect(filename):
+    """
+    Returns a client connected to the server for the given data file,
+    or None if no server is running for it.
+    """
+    socket_path = default_socket_path(filename)
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        client = AssistantClient(socket_path)
+        client.request('ping')
+    except (OSError, ValueError):
+        return None
+    return client
+
+
+def command_loop(view, words, run):
+    """
+    Reads the commands typed at the prompt and passes each one to `run`
+    until it returns True, Ctrl-C is pressed or the input ends. The
+    console gets a prompt that completes `words`; other views read plain
+    lines.
+    """
+    session = None
+    if isinstance(view, ConsoleInterface):
+        session = PromptSession(
+            completer=WordCompleter(words, ignore_case=True))
+    try:
+        while True:
+            if session is not None:
+                data = session.prompt("\nPlease enter the command: ")
+            else:
+                data = view.ask("\nPlease enter the command: ")
+            if run(data.strip()):
+                return
+    except (KeyboardInterrupt, EOFError):
+        view.display_message("Good bye!")
+
+
+def run_remote(client, data, view, output):
+    """
+    Runs one command on the server. Every question it asks is answered
+    here and the command is sent again with all the answers so far; only
+    the output that was not shown yet is printed. Returns its result.
+    """
+    answers = []
+    shown = 0
+    while True:
+        response = client.request('run', command=data, answers=answers,
+                                  output=output)
+        sys.stdout.write(response['output'][shown:])
+        sys.stdout.flush()
+        shown = len(response['output'])
+        if response['question'] is None:
+            return response['result']
+        answers.append(view.ask(response['question'] + ' '))
+
+
+def run_session(client, view, output='console'):
+    """
+    Runs the prompt against a running server. The commands are those of
+    the personal assistant, run by the server on its book; `output` names
+    the kind of `view` so that the server renders results the same way.
+    """
+    def run(data):
+        try:
+            result = run_remote(client, data, view, output)
+        except (ValueError, ConnectionError) as e:
+            view.display_message(f"Error: {str(e)}")
+            return False
+        if result == "Good bye!":
+            client.request('save')
+            return True
+        return False
+
+    view.display_message(
+        f"\nConnected to the server at {client.socket_path}.\n"
+        " Type 'help' to see available commands.")
+    try:
+        command_loop(view, client.request('commands'), run)
+    finally:
+        client.close()
+
+
+def main():
+    """
+    One-shot usage: personal-assistant-client <filename> <op> [key=value ...]
+    """
+    if len(sys.argv) < 3:
+        print("Usage: personal-assistant-client <filename> <op> "
+              "[key=value ...]")
+        return
+    filename, op = sys.argv[1], sys.argv[2]
+    args = dict(arg.split('=', 1) for arg in sys.argv[3:])
+    client = connect(filename)
+    if client is None:
+        print(f"No server is running for {filename}.")
+        return
+    try:
+        print(json.dumps(client.request(op, **args),
+                         indent=2, ensure_ascii=False))
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from bisect import bisect_left, bisect_right
+import threading
+
+from prompt_toolkit.completion import Completer, Completion
+
+# Most suggestions shown for one prefix
+COMPLETION_LIMIT = 50
+
+# With more pending changes than this the sorted list is rebuilt in one
+# sort instead of inserting and deleting entries one at a time
+REBUILD_LIMIT = 1000
+
+# Names copied at a time while going through the index in order
+ITERATION_CHUNK = 256
+
+
+class PrefixIndex:
+    """
+    class for finding names by their first letters
+
+    Names are kept in a list sorted by their lowercase form, so all names
+    starting with a prefix sit next to each other and are found with one
+    binary search. Changes are collected and applied on the next lookup,
+    so loading a whole book costs one sort, not one insert per name.
+    """
+
+    def __init__(self):
+        self.names = set()
+        self.keys = []       # Lowercase names, sorted
+        self.sorted_names = []  # The names in the same order as keys
+        self.added = set()
+        self.removed = set()
+        # Lookups come from the completer thread
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        with self.lock:
+            if name in self.names:
+                return
+            self.names.add(name)
+            if name in self.removed:
+                self.removed.discard(name)
+            else:
+                self.added.add(name)
+
+    def remove(self, name):
+        with self.lock:
+            if name not in self.names:
+                return
+            self.names.discard(name)
+            if name in self.added:
+                self.added.discard(name)
+            else:
+                self.removed.add(name)
+
+    def clear(self):
+        with self.lock:
+            self.names.clear()
+            self.keys = []
+            self.sorted_names = []
+            self.added.clear()
+            self.removed.clear()
+
+    def _apply_changes(self):
+        if len(self.added) + len(self.removed) > REBUILD_LIMIT:
+            self.sorted_names = sorted(self.names, key=str.lower)
+            self.keys = [name.lower() for name in self.sorted_names]
+        else:
+            for name in self.removed:
+                position = bisect_left(self.keys, name.lower())
+                while self.sorted_names[position] != name:
+                    position += 1
+                del self.keys[position]
+                del self.sorted_names[position]
+            for name in self.added:
+                key = name.lower()
+                position = bisect_right(self.keys, key)
+                self.keys.insert(position, key)
+                self.sorted_names.insert(position, name)
+        self.added.clear()
+        self.removed.clear()
+
+    def starting_with(self, prefix, limit=COMPLETION_LIMIT):
+        """
+        Returns up to `limit` names (all if None) starting with prefix,
+        ignoring case.
+        """
+        prefix = prefix.lower()
+        with self.lock:
+            self._apply_changes()
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\uffff', start)
+            if limit is not None:
+                end = min(end, start + limit)
+            return self.sorted_names[start:end]
+
+    def page(self, start=0, count=None):
+        """Returns `count` names (all if None) from position `start`."""
+        with self.lock:
+            self._apply_changes()
+            end = None if count is None else start + count
+            return self.sorted_names[start:end]
+
+    def names_from(self, start=0):
+        """
+        Yields the names in order from position `start`. They are copied
+        a chunk at a time, so stopping early copies only what was read.
+        """
+        position = start
+        while True:
+            names = self.page(position, ITERATION_CHUNK)
+            yield from names
+            if len(names) < ITERATION_CHUNK:
+                return
+            position += len(names)
+
+    def lookup(self, name):
+        """Returns the stored name equal to `name` ignoring case, or None."""
+        found = self.starting_with(name, 1)
+        if found and found[0].lower() == name.lower():
+            return found[0]
+        return None
+
+
+class PrefixCompleter(Completer):
+    """class for suggesting the names in a PrefixIndex as the user types"""
+
+    def __init__(self, index, limit=COMPLETION_LIMIT):
+        self.index = index
+        self.limit = limit
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor.lstrip()
+        for name in self.index.starting_with(text, self.limit):
+            yield Completion(name, start_position=-len(text))
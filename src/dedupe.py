@@ -0,0 +1,124 @@
+MATCH_KEYS = ('phone', 'email', 'name')
+
+
+class MergeRules:
+    """class for configuring how duplicate contacts are found and merged"""
+
+    def __init__(self, match_on=MATCH_KEYS, keep='most_complete',
+                 birthday='keep'):
+        # match_on: which blocking keys make two contacts duplicates
+        # keep: 'most_complete' keeps the contact with the most details,
+        #       'first' keeps the one added first
+        # birthday: 'keep' keeps the kept contact's birthday if it has one,
+        #           'latest' takes the birthday of the last merged contact
+        unknown = set(match_on) - set(MATCH_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown match keys: {', '.join(unknown)}")
+        if keep not in ('most_complete', 'first'):
+            raise ValueError(f"Unknown keep rule: {keep}")
+        if birthday not in ('keep', 'latest'):
+            raise ValueError(f"Unknown birthday rule: {birthday}")
+        self.match_on = tuple(match_on)
+        self.keep = keep
+        self.birthday = birthday
+
+
+def normalize_name(name):
+    # 'Ivan  Petrov' and 'petrov ivan' give the same key
+    return ' '.join(sorted(name.lower().split()))
+
+
+def blocking_keys(record, match_on=MATCH_KEYS):
+    if 'phone' in match_on:
+        for phone in record.phones:
+            yield 'phone', phone.canonical
+    if 'email' in match_on:
+        for email in record.emails:
+            yield 'email', email.value.lower()
+    if 'name' in match_on:
+        yield 'name', normalize_name(record.name.value)
+
+
+def find_duplicates(address_book, rules=None):
+    """
+    Groups contacts that share a normalized phone, email or name.
+
+    Instead of comparing every pair, each contact is filed under its
+    blocking keys and contacts sharing a key are joined with union-find,
+    so the whole book is processed in near-linear time. Returns a list
+    of groups, each a list of (key, record) pairs in book order.
+    """
+    rules = rules or MergeRules()
+    items = list(address_book.data.items())
+    parent = list(range(len(items)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    first_seen = {}
+    for i, (_, record) in enumerate(items):
+        for key in blocking_keys(record, rules.match_on):
+            j = first_seen.setdefault(key, i)
+            if j != i:
+                a, b = root(i), root(j)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+    groups = {}
+    for i in range(len(items)):
+        groups.setdefault(root(i), []).append(items[i])
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def completeness(record):
+    return (len(record.phones) + len(record.emails) + len(record.addresses)
+            + (1 if record.birthday else 0))
+
+
+def merge_group(address_book, group, rules=None):
+    """
+    Merges a group of duplicates into one contact and deletes the rest.
+    Phones, emails and addresses are combined without repeats.
+    Returns the kept record.
+    """
+    rules = rules or MergeRules()
+    if rules.keep == 'most_complete':
+        kept_key, kept = max(group, key=lambda item: completeness(item[1]))
+    else:
+        kept_key, kept = group[0]
+    seen = {
+        'phones': {phone.canonical for phone in kept.phones},
+        'emails': {e.value.lower() for e in kept.emails},
+        'addresses': {a.value.lower() for a in kept.addresses},
+    }
+    for key, record in group:
+        if record is kept:
+            continue
+        for phone in record.phones:
+            if phone.canonical not in seen['phones']:
+                seen['phones'].add(phone.canonical)
+                kept.phones.append(phone)
+        for email in record.emails:
+            if email.value.lower() not in seen['emails']:
+                seen['emails'].add(email.value.lower())
+                kept.emails.append(email)
+        for address in record.addresses:
+            if address.value.lower() not in seen['addresses']:
+                seen['addresses'].add(address.value.lower())
+                kept.addresses.append(address)
+        if record.birthday and (rules.birthday == 'latest'
+                                or kept.birthday is None):
+            kept.birthday = record.birthday
+        address_book.delete(key)
+    kept._changed()
+    return kept
+
+
+def dedupe(address_book, rules=None):
+    """Finds and merges all duplicate groups. Returns the kept records."""
+    rules = rules or MergeRules()
+    return [merge_group(address_book, group, rules)
+            for group in find_duplicates(address_book, rules)]
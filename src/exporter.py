@@ -0,0 +1,166 @@
+import csv
+import json
+
+from src.birthdays import parse_birthday
+from src.tally import note_tags
+
+CONTACT_FIELDS = ['name', 'phones', 'emails', 'addresses', 'birthday']
+NOTE_FIELDS = ['title', 'author', 'created_at', 'tags', 'body']
+# vCard content lines are folded to this many octets
+VCARD_LINE_OCTETS = 75
+
+
+def select_contacts(address_book, query=None, days=None):
+    """
+    Yields the contacts whose name contains `query` and, if `days` is
+    given, whose birthday falls within the next `days` days.
+    """
+    if days is not None:
+        records = address_book.search_by_birthday(days)
+    else:
+        records = address_book.data.values()
+    query = query.lower() if query else None
+    for record in records:
+        if query is None or query in record.name.value.lower():
+            yield record
+
+
+def select_notes(notebook, query=None, tag=None):
+    """
+    Yields the notes whose title, author or body contains `query` and
+    that carry `tag`.
+    """
+    query = query.lower() if query else None
+    if tag and not tag.startswith('#'):
+        tag = '#' + tag
+    tag = tag.lower() if tag else None
+    for note in notebook.data.values():
+        # Whole tags: '#work' is not a part of '#homework'
+        if tag and tag not in (found.lower() for found in note_tags(note)):
+            continue
+        if query is None or query in note.title.value.lower() \
+                or query in note.author.value.lower() \
+                or query in note.body.lower():
+            yield note
+
+
+def contacts_to_csv(records, file):
+    writer = csv.writer(file)
+    writer.writerow(CONTACT_FIELDS)
+    count = 0
+    for record in records:
+        data = record.to_dict()
+        writer.writerow([
+            data['name'], '; '.join(data['phones']),
+            '; '.join(data['emails']), '; '.join(data['addresses']),
+            data['birthday'] or ''])
+        count += 1
+    return count
+
+
+def vcard_escape(value):
+    return (value.replace('\\', '\\\\').replace('\n', '\\n')
+            .replace(',', '\\,').replace(';', '\\;'))
+
+
+def vcard_fold(line):
+    """
+    Folds a content line into lines of at most VCARD_LINE_OCTETS octets
+    of UTF-8, each continuation starting with a space, without splitting
+    a character.
+    """
+    if len(line.encode('utf-8')) <= VCARD_LINE_OCTETS:
+        return line
+    parts, current, size = [], '', 0
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > VCARD_LINE_OCTETS:
+            parts.append(current)
+            current, size = ' ', 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n'.join(parts)
+
+
+def vcard_name(name):
+    """
+    The N property: family name;given name;additional names;;. The first
+    word is taken as the given name and the last as the family name.
+    """
+    words = name.split()
+    given = words[0] if words else ''
+    family = words[-1] if len(words) > 1 else ''
+    additional = ' '.join(words[1:-1])
+    return ';'.join(vcard_escape(part)
+                    for part in (family, given, additional, '', ''))
+
+
+def contact_to_vcard(record):
+    name = vcard_escape(record.name.value)
+    lines = ['BEGIN:VCARD', 'VERSION:3.0', f'FN:{name}',
+             f'N:{vcard_name(record.name.value)}']
+    for phone in record.phones:
+        lines.append(f'TEL;TYPE=CELL:{phone.canonical}')
+    for email in record.emails:
+        lines.append(f'EMAIL;TYPE=INTERNET:{vcard_escape(email.value)}')
+    for address in record.addresses:
+        lines.append(f'ADR;TYPE=HOME:;;{vcard_escape(address.value)};;;;')
+    if record.birthday:
+        parsed = parse_birthday(record.birthday.value)
+        if parsed:
+            day, month, year = parsed
+            lines.append(f'BDAY:{year:04d}-{month:02d}-{day:02d}')
+    lines.append('END:VCARD')
+    return '\r\n'.join(vcard_fold(line) for line in lines) + '\r\n'
+
+
+def contacts_to_vcard(records, file):
+    count = 0
+    for record in records:
+        file.write(contact_to_vcard(record))
+        count += 1
+    return count
+
+
+def to_jsonl(items, file):
+    count = 0
+    for item in items:
+        file.write(json.dumps(item.to_dict(), ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def notes_to_csv(notes, file):
+    writer = csv.writer(file)
+    writer.writerow(NOTE_FIELDS)
+    count = 0
+    for note in notes:
+        data = note.to_dict()
+        writer.writerow([data[field] for field in NOTE_FIELDS])
+        count += 1
+    return count
+
+
+WRITERS = {
+    ('contacts', 'csv'): contacts_to_csv,
+    ('contacts', 'vcard'): contacts_to_vcard,
+    ('contacts', 'jsonl'): to_jsonl,
+    ('notes', 'csv'): notes_to_csv,
+    ('notes', 'jsonl'): to_jsonl,
+}
+
+
+def export(filename, kind, fmt, items):
+    """
+    Streams `items` (contacts or notes) to `filename` one at a time, so
+    memory use does not grow with the size of the book. Returns the
+    number of exported items.
+    """
+    writer = WRITERS.get((kind, fmt))
+    if writer is None:
+        formats = ', '.join(f for k, f in WRITERS if k == kind)
+        raise ValueError(f"Cannot export {kind} as {fmt}. "
+                         f"Available formats: {formats}")
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        return writer(items, file)
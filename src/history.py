@@ -0,0 +1,47 @@
+from difflib import SequenceMatcher
+import os
+
+# Every CHECKPOINT_EVERY-th revision is stored in full, so rebuilding any
+# revision applies fewer than CHECKPOINT_EVERY deltas
+CHECKPOINT_EVERY = 10
+
+# Changed regions larger than this (old size * new size) are stored as a
+# single replacement instead of being diffed character by character
+DIFF_LIMIT = 1 << 20
+
+
+def make_delta(old, new):
+    """
+    Returns the edits that turn `old` into `new` as a list of
+    [start, end, text]: replace old[start:end] with text. The size of the
+    delta follows the size of the change, not the size of the note.
+    """
+    prefix = len(os.path.commonprefix([old, new]))
+    suffix = len(os.path.commonprefix([old[prefix:][::-1],
+                                       new[prefix:][::-1]]))
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+    if not old_middle and not new_middle:
+        return []
+    if len(old_middle) * len(new_middle) > DIFF_LIMIT:
+        return [[prefix, prefix + len(old_middle), new_middle]]
+    matcher = SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    return [[prefix + i1, prefix + i2, new_middle[j1:j2]]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != 'equal']
+
+
+def apply_delta(old, delta):
+    parts = []
+    position = 0
+    for start, end, text in delta:
+        parts.append(old[position:start])
+        parts.append(text)
+        position = end
+    parts.append(old[position:])
+    return ''.join(parts)
+
+
+def delta_size(delta):
+    """Number of characters removed and inserted by the delta."""
+    return sum(end - start + len(text) for start, end, text in delta)
@@ -1,32 +1,130 @@
-from tabulate import tabulate
-from termcolor import colored
 from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import WordCompleter
+from prompt_toolkit.completion import WordCompleter, ThreadedCompleter
 from prompt_toolkit.lexers import PygmentsLexer
+from prompt_toolkit.patch_stdout import patch_stdout
 from pygments.lexers.sql import SqlLexer
 from src.classes import AddressBook, Name, Phone, Email, Address, Record
 from src.classes import Notebook, Note
 from src.classes import BasicInterface, ConsoleInterface
+from src.classes import JsonLinesInterface
 from src.sorter import main as sort_main
+from src.watcher import FolderWatcher
+from src.reminders import ReminderScheduler
+from src.completion import PrefixCompleter
+from src.client import connect, run_session
+from src.storage import AutoSaver
+from src.exporter import export, select_contacts, select_notes
+from src.history import delta_size
+from src.stats import collect_stats, collect_report
+from src.tally import note_tags
+from src.query import run_query, explain_query
+from src.session import RECORD_VARIABLE, SessionRecorder
+from src.dedupe import MergeRules, MATCH_KEYS, find_duplicates, merge_group
+from datetime import datetime
+import calendar
+import itertools
+import os
 import random
+import re
+import signal
 import textwrap
 
 address_book = AddressBook()
 notebook = Notebook()
 view = ConsoleInterface()
 
+# Number of best matching notes shown by 'find note'
+FIND_NOTES_LIMIT = 10
+# Query results are printed in tables of this many rows as they come
+QUERY_PAGE_SIZE = 50
+# Contacts shown at a time by 'show all contacts'
+CONTACTS_PAGE_SIZE = 20
+
+# Columns of contact and note tables: (key, heading, color)
+CONTACT_COLUMNS = [('name', "Contact", 'magenta'),
+                   ('phones', "Phone numbers", 'yellow'),
+                   ('emails', "Email", 'blue'),
+                   ('addresses', "Address", 'cyan'),
+                   ('birthday', "Birthday", 'green')]
+NOTE_COLUMNS = [('title', "Title", 'cyan'), ('author', "Author", 'green'),
+                ('created_at', "Created At", 'blue'),
+                ('preview', "Note", 'yellow'), ('tags', "Tags", 'magenta')]
+
+# Views that can be chosen with OUTPUT_VARIABLE at startup
+OUTPUT_VARIABLE = 'PERSONAL_ASSISTANT_OUTPUT'
+INTERFACES = {'console': ConsoleInterface, 'json': JsonLinesInterface}
+
+# Records the session when RECORD_VARIABLE names a file
+recorder = None
+
 # Completer for commands in terminal:
 sql_completer = WordCompleter([
     'hello', 'help', 'add contact', 'add phone', 'add email', 'add address',
     'change phone', 'change birthday', 'change name', 'change email',
     'change address', 'remove phone', 'remove email', 'remove address',
-    'clear all', 'search by birthday', 'days to birthday', 'delete contact',
-    'search', 'find phone', 'show all contacts', 'sort folder', 'create note',
+    'clear all', 'search by birthday', 'days to birthday', 'birthday digest',
+    'birthdays by month', 'who turns', 'delete contact',
+    'dedupe contacts',
+    'search', 'email domains', 'find phone', 'phone owner',
+    'show all contacts', 'show all contacts by birthday', 'sort folder',
+    'watch folder', 'stop watching', 'create note',
     'change title', 'add tags', 'edit note', 'delete note', 'find note',
     'show all notes', 'show note', 'find tags', 'sort notes', 'delete tags',
+    'note history', 'note revert', 'export', 'bulk add tags',
+    'bulk delete tags', 'bulk delete notes', 'bulk delete contacts',
+    'bulk remove phones', 'stats', 'stats json', 'report', 'report json',
+    'verify', 'select',
+    'explain select',
+    'from contacts', 'from notes', 'where', 'order by', 'limit', 'like',
+    'within', 'days', 'match',
     'good bye', 'close', 'exit', '.'
 ], ignore_case=True)
 
+# Completers for contact names and note titles. They run in a thread,
+# so looking names up never holds up typing.
+name_completer = ThreadedCompleter(PrefixCompleter(address_book.names))
+title_completer = ThreadedCompleter(PrefixCompleter(notebook.titles))
+# Session for answers to questions, set up by main() in a terminal
+answer_session = None
+
+
+def ask(message, completer=None):
+    # Commands run holding the book's lock. It is let go while the user
+    # types, so that the autosaver and the reminders never wait for them.
+    unlocked = unlock_book()
+    try:
+        if answer_session is None or completer is None:
+            return view.ask(message)
+        # Reminders that come due while the user answers appear above
+        with patch_stdout(raw=True):
+            answer = answer_session.prompt(message, completer=completer)
+        if recorder is not None:
+            recorder.answer(answer)
+        return answer
+    finally:
+        if unlocked:
+            address_book.lock.acquire()
+
+
+def unlock_book():
+    """
+    Lets go of the book's lock if this thread holds it for a command.
+    Returns True if it did.
+    """
+    try:
+        address_book.lock.release()
+    except RuntimeError:
+        return False
+    return True
+
+
+def ask_name(message):
+    return ask(message, name_completer)
+
+
+def ask_title(message):
+    return ask(message, title_completer)
+
 
 def input_error(func):
     def wrapper(*args, **kwargs):
@@ -87,49 +185,85 @@ def help():
         ("search by birthday", "Search contact by birthday."),
         ("days to birthday",
          "Show the number of days until the birthday for a contact."),
+        ("birthday digest",
+         "Show upcoming birthdays grouped by day with the age turned."),
+        ("birthdays by month", "Show how many birthdays fall in each month."),
+        ("who turns", "Show contacts turning a given age on their next "
+         "birthday."),
         ("delete contact", "Delete an entire contact."),
+        ("dedupe contacts", "Find contacts sharing a phone, email or name "
+         "and merge them."),
         ("search", "Search for contacts by name or phone number "
-         "that match the entered string."),
+         "that match the entered string. 'email:@corp.ua' and "
+         "'address:Khreshchatyk' search emails and addresses."),
+        ("email domains", "Show how many contacts use every email domain."),
         ("find phone", "Show all phone numbers for an contact."),
+        ("phone owner", "Show the contacts that own a phone number "
+         "written in any format."),
         ("show all contacts", "Show all existing contacts with phones, "
-         "emails, addresses, birthday."),
+         "emails, addresses, birthday, by name or by next birthday "
+         "('show all contacts by birthday'), a page at a time."),
         ("sort folder",
          "Sorts a folder by different types of files at the specified path."),
+        ("watch folder", "Keep a folder sorted: new files are sorted in "
+         "the background as they arrive."),
+        ("stop watching", "Stop sorting watched folders."),
         ("create note", "Create a new note in the Notebook."),
         ("change title", "Change the title of an existing note."),
         ("add tags", "Adds tags to an existing note."),
         ("edit note", "Edit the content of an existing note."),
         ("delete note", "Delete an existing note."),
-        ("find note", "Find notes containing the specified query in the title "
-         "or body or by author."),
+        ("find note", f"Find the {FIND_NOTES_LIMIT} notes best matching the "
+         "query in the title, tags, body or author."),
         ("show note", "Display the contents of the selected note"),
         ("show all notes", "Display all notes."),
         ("find tags", "Search for notes by tags."),
         ("sort notes", "Sort notes by tags in alphabetical order."),
         ("delete tags", "Remove a tag from a note."),
+        ("note history", "Show the revisions of a note."),
+        ("note revert", "Bring back an earlier revision of a note."),
+        ("export", "Export contacts (CSV, vCard, JSONL) or notes (CSV, JSONL) "
+         "to a file, optionally filtered."),
+        ("stats", "Show counts, index sizes, memory use and load/save "
+         "times ('stats json' for JSON)."),
+        ("report", "Show contacts without a phone, email or birthday, "
+         "birthdays per month, the most used tags and notes per author "
+         "('report json' for JSON)."),
+        ("verify", "Check the data file and validate every contact and "
+         "note loaded without validation."),
+        ("select", "Query contacts or notes, e.g. select name, phones from "
+         "contacts where birthday within 7 days and emails like "
+         "'%@corp.ua' order by name limit 20."),
+        ("explain", "Show how a select query would be answered."),
+        ("bulk add tags", "Add tags to all notes matching words and tags."),
+        ("bulk delete tags",
+         "Remove tags from all notes matching words and tags."),
+        ("bulk delete notes", "Delete all notes matching words and tags."),
+        ("bulk delete contacts", "Delete all contacts whose name or phone "
+         "number starts with the entered text."),
+        ("bulk remove phones", "Remove the phone numbers starting with "
+         "the entered digits from all contacts."),
         ("good bye or close or exit or '.'", "Exit the program.")
     ]
 
-    colored_commands = [
-        (colored(command, 'cyan'),
-         colored(description, 'green')) for command, description in commands
-    ]
-
-    table = tabulate(colored_commands,
-                     headers=["Command", "Description"], tablefmt="fancy_grid")
-    view.display_command_help(table)
+    view.display_table(
+        "Available Commands:",
+        [('command', "Command", 'cyan'),
+         ('description', "Description", 'green')],
+        [{'command': command, 'description': description}
+         for command, description in commands])
     return ""
 
 
 @input_error
 def add_contact_interactive():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask("Please enter the contact's name: ").strip()
     if address_book.find(name):
         return f"Error: A contact with the name {name} already exists."
     record = Record(name)
     added_info = []
     while True:
-        phone = input(
+        phone = ask(
             "Please enter a phone number (or nothing to finish): ").strip()
         if phone.lower() == '':
             break
@@ -137,11 +271,11 @@ def add_contact_interactive():
             record.add_phone(phone)
             added_info.append(f"Phone number: {phone}")
         except ValueError as e:
-            print(
+            view.display_message(
                 f"Error: {str(e)} Please try again. Here are some examples "
                 "(+380951111111; 80501111111; 0661111111)")
     while True:
-        email = input(
+        email = ask(
             "Please enter an email address (or nothing to finish): ").strip()
         if email.lower() == '':
             break
@@ -149,9 +283,9 @@ def add_contact_interactive():
             record.add_email(email)
             added_info.append(f"Email: {email}")
         except ValueError as e:
-            print(f"Error: {str(e)} Please try again.")
+            view.display_message(f"Error: {str(e)} Please try again.")
     while True:
-        address = input(
+        address = ask(
             "Please enter an address (or nothing to finish): ").strip()
         if address.lower() == '':
             break
@@ -159,9 +293,9 @@ def add_contact_interactive():
             record.add_address(address)
             added_info.append(f"Address: {address}")
         except ValueError as e:
-            print(f"Error: {str(e)} Please try again.")
+            view.display_message(f"Error: {str(e)} Please try again.")
     while True:
-        birthday = input(
+        birthday = ask(
             "Please enter the contact's birthday "
             "(or nothing if not available): ").strip()
         if birthday.lower() == '':
@@ -171,7 +305,7 @@ def add_contact_interactive():
             added_info.append(f"Birthday: {birthday}")
             break
         except ValueError as e:
-            print(f"Error: {str(e)} Please try again.")
+            view.display_message(f"Error: {str(e)} Please try again.")
 
     address_book.add_record(record)
 
@@ -180,7 +314,7 @@ def add_contact_interactive():
 
 @input_error
 def get_phone():
-    name = input("Please enter the name to get phone numbers: ").strip()
+    name = ask_name("Please enter the name to get phone numbers: ").strip()
     records = address_book.data.values()
     for record in records:
         if record.name.value.lower() == name.lower():
@@ -191,42 +325,40 @@ def get_phone():
 
 
 @input_error
-def show_all_contacts():
-    records = address_book.data.values()
-    if records:
-        table_data = []
-        for record in records:
-            name = colored(record.name.value, 'magenta')
-
-            phones_info = ',\n'.join(
-                colored(
-                    phone.value, 'yellow')
-                for phone in record.phones) if record.phones else ' '
-
-            email_info = ',\n'.join(
-                colored(
-                    email.value, 'blue')
-                for email in record.emails) if record.emails else ' '
-
-            address_info = ',\n'.join(
-                colored(
-                    address.value, 'cyan')
-                for address in record.addresses) if record.addresses else ' '
-
-            birthday_info = colored(
-                record.birthday, 'green') if record.birthday else ' '
-
-            table_data.append([name, phones_info, email_info,
-                               address_info, birthday_info])
-
-        headers = [colored("Contact", 'magenta'),
-                   colored("Phone numbers", 'yellow'),
-                   colored("Email", 'blue'), colored("Address", 'cyan'),
-                   colored("Birthday", 'green')]
-        table = tabulate(table_data, headers=headers, tablefmt="fancy_grid")
-        view.display_contact_info(f"Here are all the contacts saved in the Address Book:\n{table}")
-    else:
+def get_phone_owner():
+    phone = ask("Please enter the phone number: ").strip()
+    owners = address_book.find_by_phone(phone)
+    if owners:
+        names = ', '.join(record.name.value for record in owners)
+        return f"Phone number {Phone(phone).canonical} belongs to: {names}"
+    return f"No contact found with the phone number {phone}"
+
+
+@input_error
+def show_all_contacts(args=None):
+    order = 'name'
+    if args:
+        order = args.lower().removeprefix('by').strip()
+    if not address_book.data:
         view.display_message("Contact list is empty")
+        return ""
+    heading = ("Here are all the contacts saved in the Address Book"
+               + (", soonest birthday first" if order == 'birthday' else "")
+               + ":")
+    contacts = address_book.contacts_in_order(order)
+    shown = 0
+    while True:
+        records = list(itertools.islice(contacts, CONTACTS_PAGE_SIZE))
+        if not records:
+            break
+        view.display_table(heading, CONTACT_COLUMNS,
+                           [record.to_dict() for record in records])
+        shown += len(records)
+        if shown >= len(address_book.data) or ask(
+                f"Shown {shown} of {len(address_book.data)}. Press Enter "
+                "for more or 'q' to stop: ").strip().lower() == 'q':
+            break
+        heading = f"Contacts from {shown + 1}:"
     return ""
 
 
@@ -253,25 +385,12 @@ def load_from_disk(filename):
 
 @input_error
 def search_contacts():
-    query = input("Please enter a part of the name or phone number: ").strip()
+    query = ask("Please enter a part of the name or phone number "
+                "(or email:@domain, address:street): ").strip()
     results = address_book.search_contacts(query)
     if results:
-        result = ""
-        for record in results:
-            result += f"{record.name.value}:\n"
-            phones_info = ', '.join(phone.value for phone in record.phones)
-            if phones_info:
-                result += f"  Phone numbers: {phones_info}\n"
-            if record.birthday:
-                result += f"  Birthday: {record.birthday}\n"
-            email_info = ', '.join(email.value for email in record.emails)
-            if email_info:
-                result += f"  Email: {email_info}\n"
-            address_info = ', '.join(
-                address.value for address in record.addresses)
-            if address_info:
-                result += f"  Address: {address_info}\n"
-        view.display_contact_info(f"Search results for '{query}':\n{result}")
+        view.display_table(f"Search results for '{query}':", CONTACT_COLUMNS,
+                           [record.to_dict() for record in results])
     else:
         view.display_message(f"No results found for '{query}'.")
     return ""
@@ -279,7 +398,7 @@ def search_contacts():
 
 @input_error
 def when_birthday():
-    name = input("Please enter the name to check for birthday: ").strip()
+    name = ask_name("Please enter the name to check for birthday: ").strip()
     record = address_book.find(name)
     if record:
         return (f"Days until birthday for {name}: "
@@ -290,10 +409,10 @@ def when_birthday():
 
 @input_error
 def update_birthday():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        new_birthday = input("Please enter the new birthday: ").strip()
+        new_birthday = ask("Please enter the new birthday: ").strip()
         record.update_birthday(new_birthday)
         return f"Birthday for {name} has been updated to {new_birthday}."
     else:
@@ -303,22 +422,53 @@ def update_birthday():
 @input_error
 def sort_folder():
     try:
-        source_folder = input(
+        source_folder = ask(
             "Please enter the path of the folder you want to sort: ")
         if not source_folder:
             raise ValueError("Please specify the source folder.")
-        sort_main(source_folder)
+        view.display_message(sort_main(source_folder))
         return ("\nThe folder is sorted \U0001F609\nThank you "
                 "for using our sorter \U0001F64C\nHave a nice day \U0001F60A")
     except Exception as e:
-        print(f"Unexpected Error: {e}")
+        view.display_message(f"Unexpected Error: {e}")
         return ("\nAn unexpected error occurred. Please check your input and "
                 "try again.")
 
 
+# Folders kept sorted in the background by 'watch folder'
+folder_watchers = {}
+
+
+@input_error
+def watch_folder():
+    source_folder = os.path.abspath(ask(
+        "Please enter the path of the folder to keep sorted: ").strip())
+    if not os.path.isdir(source_folder):
+        raise ValueError(f"{source_folder} is not a folder.")
+    if source_folder in folder_watchers:
+        return f"{source_folder} is already being watched."
+    watcher = FolderWatcher(source_folder, report=view.display_message)
+    watcher.start()
+    folder_watchers[source_folder] = watcher
+    return (f"Watching {source_folder}: new files will be sorted as they "
+            "arrive. Type 'stop watching' to stop.")
+
+
+@input_error
+def stop_watching():
+    if not folder_watchers:
+        return "No folders are being watched."
+    stopped = []
+    for source_folder, watcher in list(folder_watchers.items()):
+        watcher.stop()
+        del folder_watchers[source_folder]
+        stopped.append(f"{source_folder} ({watcher.sorted_count} sorted)")
+    return f"Stopped watching {', '.join(stopped)}."
+
+
 @input_error
 def delete_contact():
-    name = input(
+    name = ask_name(
         "Please enter the name of the contact you want to delete: ").strip()
     try:
         address_book.delete(name)
@@ -327,12 +477,52 @@ def delete_contact():
         return f"Contact {name} not found."
 
 
+@input_error
+def clear_all_contacts():
+    answer = ask("Are you sure you want to delete all contacts? (y/n) ")
+    if answer.strip().lower() != 'y':
+        return 'Removal canceled'
+    return address_book.clear_all_contacts()
+
+
+@input_error
+def dedupe_contacts():
+    match_on = ask(
+        "Please enter what duplicates should share: phone, email, name "
+        "(or nothing for all): ").strip().lower()
+    keep = ask(
+        "Which contact to keep: 'most complete' or 'first' "
+        "(or nothing for most complete): ").strip().lower()
+    rules = MergeRules(
+        match_on=re.findall(r'\w+', match_on) or MATCH_KEYS,
+        keep='first' if keep == 'first' else 'most_complete')
+    groups = find_duplicates(address_book, rules)
+    if not groups:
+        return "No duplicate contacts found."
+    view.display_table(
+        f"Found {len(groups)} groups of duplicate contacts:",
+        [('contacts', "Contacts", 'magenta', ', '.join),
+         ('phones', "Phone numbers", 'yellow'), ('emails', "Email", 'blue')],
+        [{'contacts': [record.name.value for _, record in group],
+          'phones': sorted({phone.value for _, record in group
+                            for phone in record.phones}),
+          'emails': sorted({email.value for _, record in group
+                            for email in record.emails})}
+         for group in groups])
+    answer = ask("Merge them? (y/n) ").strip().lower()
+    if answer != 'y':
+        return 'Merge canceled'
+    kept = [merge_group(address_book, group, rules) for group in groups]
+    return (f"Merged {sum(len(group) for group in groups)} contacts into "
+            f"{len(kept)}: {', '.join(record.name.value for record in kept)}")
+
+
 @input_error
 def add_phone():
-    name = input("Please enter the name of the contact: ").strip()
+    name = ask_name("Please enter the name of the contact: ").strip()
     record = address_book.find(name)
     if record:
-        phone = input("Please enter the phone number to add: ").strip()
+        phone = ask("Please enter the phone number to add: ").strip()
         phone_field = Phone(phone)
         record.add_phone(phone_field.value)
         return f"Phone {phone} has been added to contact {name}."
@@ -342,11 +532,11 @@ def add_phone():
 
 @input_error
 def add_email():
-    name = input(
+    name = ask_name(
         "Please enter the name of the contact to add email to: ").strip()
     record = address_book.find(name)
     if record:
-        email = input("Please enter the email to add: ").strip()
+        email = ask("Please enter the email to add: ").strip()
         email_field = Email(email)
         record.add_email(email_field.value)
         return f"Email {email} has been added to contact {name}."
@@ -356,26 +546,71 @@ def add_email():
 
 @input_error
 def search_contact_by_birthday():
-    request = input("Please enter the range for birthday search : ").strip()
+    request = ask("Please enter the range for birthday search : ").strip()
     address = address_book.search_by_birthday(request)
     if len(address) == 0:
         return '\nContacts not found in this range!'
-    result = ''
-    for i in address:
-        phones_info = ', '.join(phone.value for phone in i.phones)
-        result += (f"{i.name.value}:\n Phone numbers: {phones_info}\n"
-                   f"Birthday: {i.birthday}\n")
-    view.display_contact_info(f"The following contacts have a birthday in the next {request} days:\n{result}")
+    view.display_table(
+        f"The following contacts have a birthday in the next {request} days:",
+        [CONTACT_COLUMNS[0], CONTACT_COLUMNS[1], CONTACT_COLUMNS[4]],
+        [record.to_dict() for record in address])
+    return ""
+
+
+@input_error
+def birthday_digest():
+    request = ask(
+        "Please enter the number of days (or nothing for a week): ").strip()
+    digest = address_book.birthday_digest(request or 7)
+    if not digest:
+        return '\nNo birthdays in this range!'
+    view.display_table(
+        "Upcoming birthdays:",
+        [('date', "Date", 'green', lambda day: day.strftime('%d.%m.%Y, %A')),
+         ('contacts', "Contacts (age)", 'magenta',
+          lambda people: ',\n'.join(f"{person['name']} ({person['age']})"
+                                    for person in people))],
+        [{'date': day,
+          'contacts': [{'name': record.name.value, 'age': age}
+                       for record, age in people]}
+         for day, people in digest])
+    return ""
+
+
+@input_error
+def birthdays_by_month():
+    histogram = address_book.birthdays.month_histogram()
+    view.display_table(
+        "Birthdays per month:",
+        [('month', "Month", 'green'), ('birthdays', "Birthdays", 'yellow'),
+         ('birthdays', "", 'magenta', lambda count: '#' * min(count, 50))],
+        [{'month': calendar.month_name[month], 'birthdays': count}
+         for month, count in histogram.items()])
+    return ""
+
+
+@input_error
+def who_turns():
+    age = int(ask("Please enter the age: ").strip())
+    results = address_book.birthdays.turning(age)
+    if not results:
+        return f"Nobody turns {age} on their next birthday."
+    view.display_table(
+        f"Contacts turning {age}:",
+        [('date', "Date", 'green', lambda day: day.strftime('%d.%m.%Y')),
+         ('name', "Contact", 'magenta')],
+        [{'date': day, 'name': record.name.value} for day, record in results])
     return ""
 
 
 @input_error
 def add_address():
-    name = input(
+    name = ask_name(
         "Please enter the name of the contact to add an address: ").strip()
     record = address_book.find(name)
     if record:
-        address = input("Please enter the address you want to add: ").strip()
+        address = ask(
+            "Please enter the address you want to add: ").strip()
         address_field = Address(address)
         record.add_address(address_field.value)
         return f"Address '{address}' has been added to contact '{name}'."
@@ -385,10 +620,10 @@ def add_address():
 
 @input_error
 def remove_phone_from_contact():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        phone = input("Please enter the phone number to remove: ").strip()
+        phone = ask("Please enter the phone number to remove: ").strip()
         result = record.remove_phone(phone)
         return result
     else:
@@ -397,10 +632,10 @@ def remove_phone_from_contact():
 
 @input_error
 def remove_email_from_contact():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        email = input("Please enter the email to remove: ").strip()
+        email = ask("Please enter the email to remove: ").strip()
         result = record.remove_email(email)
         return result
     else:
@@ -409,10 +644,10 @@ def remove_email_from_contact():
 
 @input_error
 def remove_address_from_contact():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        address = input("Please enter the address to remove: ").strip()
+        address = ask("Please enter the address to remove: ").strip()
         result = record.remove_address(address)
         return result
     else:
@@ -421,10 +656,10 @@ def remove_address_from_contact():
 
 @input_error
 def change_name():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        new_name = input("Please enter the new name: ").strip()
+        new_name = ask("Please enter the new name: ").strip()
         new_name_field = Name(new_name)
         result = record.edit_name(new_name_field.value)
         return result
@@ -434,11 +669,11 @@ def change_name():
 
 @input_error
 def change_phone():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        old_phone = input("Please enter the old phone number: ").strip()
-        new_phone = input("Please enter the new phone number: ").strip()
+        old_phone = ask("Please enter the old phone number: ").strip()
+        new_phone = ask("Please enter the new phone number: ").strip()
         new_phone_field = Phone(new_phone)
         result = record.edit_phone(old_phone, new_phone_field.value)
         return result
@@ -448,11 +683,11 @@ def change_phone():
 
 @input_error
 def change_email():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        old_email = input("Please enter the old email: ").strip()
-        new_email = input("Please enter the new email: ").strip()
+        old_email = ask("Please enter the old email: ").strip()
+        new_email = ask("Please enter the new email: ").strip()
         new_email_field = Email(new_email)
         result = record.edit_email(old_email, new_email_field.value)
         return result
@@ -462,11 +697,11 @@ def change_email():
 
 @input_error
 def change_address():
-    name = input("Please enter the contact's name: ").strip()
+    name = ask_name("Please enter the contact's name: ").strip()
     record = address_book.find(name)
     if record:
-        old_address = input("Please enter the old address: ").strip()
-        new_address = input("Please enter the new address: ").strip()
+        old_address = ask("Please enter the old address: ").strip()
+        new_address = ask("Please enter the new address: ").strip()
         new_address_field = Address(new_address)
         result = record.edit_address(old_address, new_address_field.value)
         return result
@@ -476,39 +711,33 @@ def change_address():
 
 @input_error
 def create_note():
-    author = input("Please enter the author's name: ").strip()
-    title = input("Please enter the note's title: ").strip()
-    body = input("Please enter the note's text: ").strip()
-    tags = notebook.tag_conversion(input(
+    author = ask("Please enter the author's name: ").strip()
+    title = ask("Please enter the note's title: ").strip()
+    body = ask("Please enter the note's text: ").strip()
+    tags = notebook.tag_conversion(ask(
         "Please enter the note's tags: ").strip())
     note = Note(author, title, body, tags)
     notebook.add_note(note)
     return f"Note '{title}' by {author} has been created."
 
 
+def note_row(note):
+    return {'title': note.title.value, 'author': note.author.value,
+            'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'preview': note.preview, 'tags': note_tags(note)}
+
+
 @input_error
 def find_note():
-    query = input(
+    query = ask(
         "Please enter search query for notes "
-        "(author, title, or content): ").strip()
+        "(author, title, tags or content): ").strip()
     if not query:
         return "Please provide a search query."
-    results = notebook.find_notes(query)
+    results = notebook.find_notes(query, FIND_NOTES_LIMIT)
     if results:
-        table_data = []
-        for note in results:
-            short_note = (
-                note.body[:12] + '...') if len(note.body) > 15 else note.body
-            table_data.append([
-                colored(note.title.value, 'cyan'),
-                colored(note.author.value, 'green'),
-                colored(note.created_at.strftime('%Y-%m-%d %H:%M:%S'), 'blue'),
-                colored(short_note, 'yellow'),
-                colored(note.tags, 'magenta')
-            ])
-        headers = ["Title", "Author", "Created At", "Note", "Tags"]
-        table = tabulate(table_data, headers=headers, tablefmt="fancy_grid")
-        view.display_note_info(f"Found notes for query '{query}':\n{table}")
+        view.display_table(f"Best matching notes for query '{query}':",
+                           NOTE_COLUMNS, [note_row(note) for note in results])
     else:
         view.display_note_info(f"No notes found with the given query '{query}'.")
     return ""
@@ -516,18 +745,14 @@ def find_note():
 
 @input_error
 def show_note_detail():
-    title = input(
+    title = ask_title(
         "Please enter the title of the note you want to view: ").strip()
     note = notebook.get_note(title)
     if note:
-        wrapped_body = textwrap.fill(note.body, width=79)
-        result = f"\nTitle: {note.title.value}\n"
-        result += f"Author: {note.author.value}\n"
-        result += (f"Created at: "
-                   f"{note.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n")
-        result += f"Tags: {note.tags}\n"
-        result += f"Note:\n{wrapped_body}\n"        
-        view.display_note_info(f"Note Info:\n{result}\n")
+        view.display_record("Note Info:", {
+            'title': note.title.value, 'author': note.author.value,
+            'created_at': note.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'tags': note_tags(note), 'note': note.body})
     else:
         view.display_message(f"No note found with the title '{title}'.")        
     return ""
@@ -535,8 +760,9 @@ def show_note_detail():
 
 @input_error
 def change_note_title():
-    old_title = input("Please enter the current title of the note: ").strip()
-    new_title = input("Please enter the new title for the note: ").strip()
+    old_title = ask_title(
+        "Please enter the current title of the note: ").strip()
+    new_title = ask("Please enter the new title for the note: ").strip()
 
     note = notebook.get_note(old_title)
     if note:
@@ -551,16 +777,16 @@ def change_note_title():
 
 @input_error
 def edit_note_text():
-    title = input(
+    title = ask_title(
         "Please enter a title of the note you want to edit: ").strip()
     note = notebook.get_note(title)
     if note:
-        print(f"Current note text:\n{note.body}")
-        new_body = input(
+        view.display_message(f"Current note text:\n{note.body}")
+        new_body = ask(
             "Please enter a new note text (or press Enter to keep "
             "the current text): ").strip()
         if new_body:
-            note.edit_note(new_body)
+            notebook.edit_note(title, new_body)
             return f"Note '{title}' has been updated."
         else:
             return "Note's content has not been changed."
@@ -568,9 +794,54 @@ def edit_note_text():
         raise KeyError(f"Note '{title}' not found")
 
 
+@input_error
+def show_note_history():
+    title = ask_title(
+        "Please enter the title of the note to show its history: ").strip()
+    note = notebook.get_note(title)
+    if not note:
+        raise KeyError(f"Note '{title}' not found")
+    if not note.history:
+        return f"Note '{title}' has not been edited yet."
+    rows = []
+    for number, revision in enumerate(note.history):
+        data = note.revision_data(revision)
+        change = (f"full text, {len(data)} characters"
+                  if revision['kind'] == 'full'
+                  else f"{delta_size(data)} characters changed")
+        rows.append({'revision': number,
+                     'saved_at': datetime.fromisoformat(revision['at']),
+                     'change': change})
+    view.display_table(
+        f"History of the note '{title}':",
+        [('revision', "Revision", 'cyan'),
+         ('saved_at', "Saved At", 'blue',
+          lambda at: at.strftime('%Y-%m-%d %H:%M:%S')),
+         ('change', "Change", 'yellow')], rows)
+    return ""
+
+
+@input_error
+def revert_note():
+    title = ask_title(
+        "Please enter the title of the note you want to revert: ").strip()
+    note = notebook.get_note(title)
+    if not note:
+        raise KeyError(f"Note '{title}' not found")
+    number = int(ask("Please enter the revision number: ").strip())
+    text = note.revision_text(number)
+    view.display_message(
+        f"Revision {number} text:\n{textwrap.fill(text, width=79)}")
+    answer = ask("Revert the note to this text? (y/n) ").strip().lower()
+    if answer != 'y':
+        return 'Revert canceled'
+    notebook.revert_note(title, number)
+    return f"Note '{title}' has been reverted to revision {number}."
+
+
 @input_error
 def remove_note():
-    title = input(
+    title = ask_title(
         "Please enter the title of the note you want to delete: ").strip()
     note = notebook.get_note(title)
     if note:
@@ -584,20 +855,9 @@ def remove_note():
 def show_all_notes():
     notes = notebook.data.values()
     if notes:
-        table_data = []
-        for note in notes:
-            short_note = (
-                note.body[:12] + '...') if len(note.body) > 15 else note.body
-            table_data.append([
-                colored(note.title.value, 'cyan'),
-                colored(note.author.value, 'green'),
-                colored(note.created_at.strftime('%Y-%m-%d %H:%M:%S'), 'blue'),
-                colored(short_note, 'yellow'),
-                colored(note.tags, 'magenta')
-            ])
-        headers = ["Title", "Author", "Created At", "Note", "Tags"]
-        table = tabulate(table_data, headers=headers, tablefmt="fancy_grid")
-        view.display_note_info(f"\nHere are all the notes saved in the Notebook:\n{table}\n")
+        view.display_table(
+            "\nHere are all the notes saved in the Notebook:", NOTE_COLUMNS,
+            [note_row(note) for note in notes])
     else:
         view.display_note_info("No notes found in the Notebook")        
     return ""
@@ -605,13 +865,13 @@ def show_all_notes():
 
 @input_error
 def add_tag():
-    title = input(
+    title = ask_title(
         "Please enter the title of the note where you want "
         "to add tags: ").strip()
     if title not in notebook.data.keys():
         raise ValueError(f"Note '{title}' not found")
     data_tags = notebook.data[title].tags
-    tags = notebook.tag_conversion(input("Please enter tags: ").strip())
+    tags = notebook.tag_conversion(ask("Please enter tags: ").strip())
     tag_list = tags.split(', ')
     unique_tags = ''
     for tag in tag_list:
@@ -626,20 +886,9 @@ def add_tag():
 def sort_notes_by_tags():
     sorted_notes = notebook.sort_notes_by_tags()
     if sorted_notes:
-        table_data = []
-        for note in sorted_notes:
-            short_note = (
-                note.body[:12] + '...') if len(note.body) > 15 else note.body
-            table_data.append([
-                colored(note.title.value, 'cyan'),
-                colored(note.author.value, 'green'),
-                colored(note.created_at.strftime('%Y-%m-%d %H:%M:%S'), 'blue'),
-                colored(short_note, 'yellow'),
-                colored(note.tags, 'magenta')
-            ])
-        headers = ["Title", "Author", "Created At", "Note", "Tags"]
-        table = tabulate(table_data, headers=headers, tablefmt="fancy_grid")
-        view.display_note_info(f"\nHere are all the notes sorted by tag in alphabetical order:\n{table}\n")        
+        view.display_table(
+            "\nHere are all the notes sorted by tag in alphabetical order:",
+            NOTE_COLUMNS, [note_row(note) for note in sorted_notes])
     else:
         view.display_note_info("No notes found in the Notebook")        
     return ""
@@ -647,45 +896,289 @@ def sort_notes_by_tags():
 
 @input_error
 def find_notes_by_tags():
-    tags = input("Please enter the tag by which to start searching: ").strip()
+    tags = ask(
+        "Please enter the tag by which to start searching: ").strip()
     results = notebook.find_notes_by_tags(tags)
     if not results:
         view.display_note_info(f"No notes found with the specified tag: {tags}")
         return ""
 
-    table_data = []
-    for note in results:
-        short_note = (note.body[:12] +
-                      '...') if len(note.body) > 15 else note.body
-        table_data.append([
-            colored(note.title.value, 'cyan'),
-            colored(note.author.value, 'green'),
-            colored(note.created_at.strftime('%Y-%m-%d %H:%M:%S'), 'blue'),
-            colored(short_note, 'yellow'),
-            colored(note.tags, 'magenta')
-        ])
-    headers = ["Title", "Author", "Created At", "Note", "Tags"]
-    table = tabulate(table_data, headers=headers, tablefmt="fancy_grid")
-    view.display_note_info(f"\nHere are the notes found by tags '{tags}':\n{table}\n")
+    view.display_table(f"\nHere are the notes found by tags '{tags}':",
+                       NOTE_COLUMNS, [note_row(note) for note in results])
     return ""
 
 
 @input_error
 def remove_tag():
-    title = input(
+    title = ask_title(
         "Please enter the title from which you want to remove tags: ").strip()
     if title not in notebook.data.keys():
         raise ValueError(f"Note '{title}' not found")
-    data_tags = notebook.data[title].tags
-    tags_to_remove = notebook.tag_conversion(input(
+    tags_to_remove = notebook.tag_conversion(ask(
         "Please enter tags to remove: ").strip())
-    tags_to_remove_list = tags_to_remove.split(', ')
-    updated_tags = [
-        tag for tag in data_tags.split(', ') if tag not in tags_to_remove_list]
-    notebook.data[title].tags = ', '.join(updated_tags)
+    notebook.remove_tags(title, tags_to_remove.split(', '))
     return f"Tags '{tags_to_remove}' have been removed"
 
 
+def select_notes_for_bulk(action):
+    query = ask(
+        f"Please enter the words and #tags of the notes to {action}: ").strip()
+    tags = re.findall(r'#\w+', query)
+    notes = notebook.select_notes(re.sub(r'#\w+', ' ', query), tags)
+    if not notes:
+        return None
+    view.display_table(f"\nFound {len(notes)} notes:",
+                       [NOTE_COLUMNS[0], NOTE_COLUMNS[1], NOTE_COLUMNS[4]],
+                       [note_row(note) for note in notes])
+    return notes
+
+
+def select_contacts_for_bulk(action):
+    query = ask(
+        f"Please enter the start of the name or phone number of the "
+        f"contacts to {action}: ").strip()
+    if not query:
+        raise ValueError("Please enter a name or a phone number prefix.")
+    if re.fullmatch(r'\+?\d+', query):
+        records = address_book.select_contacts(phone_prefix=query)
+    else:
+        records = address_book.select_contacts(name_prefix=query)
+    if not records:
+        return None
+    view.display_table(f"Found {len(records)} contacts:",
+                       CONTACT_COLUMNS[:2],
+                       [record.to_dict() for record in records])
+    return records
+
+
+def commit_bulk_change():
+    # The whole change goes to the data file in one write
+    if address_book.sync is not None:
+        address_book.save_to_disk(address_book.sync.filename, notebook)
+
+
+@input_error
+def bulk_add_tags():
+    notes = select_notes_for_bulk("tag")
+    if notes is None:
+        return "No notes match."
+    tags = notebook.tag_conversion(
+        ask("Please enter tags to add: ").strip())
+    if not tags:
+        raise ValueError("Please enter at least one tag.")
+    if ask(f"Add {tags} to {len(notes)} notes? (y/n) "
+             ).strip().lower() != 'y':
+        return 'Tagging canceled'
+    for note in notes:
+        notebook.add_tags(note.title.value, tags)
+    commit_bulk_change()
+    return f"Tags '{tags}' have been added to {len(notes)} notes."
+
+
+@input_error
+def bulk_remove_tags():
+    notes = select_notes_for_bulk("remove tags from")
+    if notes is None:
+        return "No notes match."
+    tags = notebook.tag_conversion(
+        ask("Please enter tags to remove: ").strip())
+    if not tags:
+        raise ValueError("Please enter at least one tag.")
+    if ask(f"Remove {tags} from {len(notes)} notes? (y/n) "
+             ).strip().lower() != 'y':
+        return 'Removal canceled'
+    for note in notes:
+        notebook.remove_tags(note.title.value, tags.split(', '))
+    commit_bulk_change()
+    return f"Tags '{tags}' have been removed from {len(notes)} notes."
+
+
+@input_error
+def bulk_delete_notes():
+    notes = select_notes_for_bulk("delete")
+    if notes is None:
+        return "No notes match."
+    if ask(f"Delete {len(notes)} notes? (y/n) ").strip().lower() != 'y':
+        return 'Removal canceled'
+    count = notebook.delete_notes([note.title.value for note in notes])
+    commit_bulk_change()
+    return f"{count} notes have been deleted."
+
+
+@input_error
+def bulk_delete_contacts():
+    records = select_contacts_for_bulk("delete")
+    if records is None:
+        return "No contacts match."
+    if ask(f"Delete {len(records)} contacts? (y/n) "
+             ).strip().lower() != 'y':
+        return 'Removal canceled'
+    count = address_book.delete_contacts(records)
+    commit_bulk_change()
+    return f"{count} contacts have been deleted."
+
+
+@input_error
+def bulk_remove_phones():
+    prefix = ask(
+        "Please enter the start of the phone numbers to remove: ").strip()
+    records = address_book.select_contacts(phone_prefix=prefix)
+    if not records:
+        return f"No phone numbers start with {prefix}."
+    if ask(f"Remove the numbers starting with {prefix} from "
+             f"{len(records)} contacts? (y/n) ").strip().lower() != 'y':
+        return 'Removal canceled'
+    count = address_book.remove_phones(prefix)
+    commit_bulk_change()
+    return (f"Phone numbers starting with {prefix} have been removed "
+            f"from {count} contacts.")
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+@input_error
+def show_stats(fmt=None):
+    stats = collect_stats(address_book, notebook)
+    if fmt and fmt.lower() == 'json':
+        view.display_data(stats)
+        return ""
+    value_formats = {
+        'indexes': lambda value: 'not built' if value is None else value,
+        'memory': format_size,
+        'timings': lambda value: (f"{value:.3f}" if isinstance(value, float)
+                                  else value),
+        'result_cache': lambda cache: (f"{cache['entries']} entries, "
+                                       f"{cache['hits']} hits, "
+                                       f"{cache['misses']} misses")}
+    view.display_message("\nPersonal Assistant statistics:")
+    for section, values in stats.items():
+        if not values:
+            continue
+        view.display_table(
+            f"{section.replace('_', ' ').capitalize()}:",
+            [('name', "Statistic", 'cyan'),
+             ('value', "Value", 'yellow', value_formats.get(section, str))],
+            [{'name': name, 'value': value} for name, value in values.items()])
+    return ""
+
+
+@input_error
+def show_report(fmt=None):
+    report = collect_report(address_book, notebook)
+    if fmt and fmt.lower() == 'json':
+        view.display_data(report)
+        return ""
+    sections = [("Contacts", report['contacts']),
+                ("Birthdays per month", report['birthdays_per_month']),
+                ("Notes", report['notes']),
+                ("Most used tags", report['tags']),
+                ("Notes per author", report['authors'])]
+    view.display_message("\nPersonal Assistant report:")
+    for title, counts in sections:
+        view.display_table(
+            f"{title}:",
+            [('name', "Name", 'cyan'), ('count', "Count", 'yellow')],
+            [{'name': name, 'count': count} for name, count in counts.items()])
+    return ""
+
+
+@input_error
+def email_domains():
+    counts = address_book.count_by_domain()
+    if not counts:
+        return "No contacts have an email address."
+    view.display_table(
+        "\nContacts by email domain:",
+        [('domain', "Domain", 'cyan'), ('contacts', "Contacts", 'yellow')],
+        [{'domain': domain, 'contacts': count} for domain, count in counts])
+    return ""
+
+
+@input_error
+def select_query(args=None):
+    if not args:
+        raise ValueError("Please write the query after 'select', e.g. "
+                         "select name, phones from contacts limit 10")
+    rows = run_query('select ' + args, address_book, notebook)
+    count = 0
+    page = []
+    for row in rows:
+        page.append(row)
+        count += 1
+        if len(page) == QUERY_PAGE_SIZE:
+            show_rows(page)
+            page = []
+    if page:
+        show_rows(page)
+    return f"{count} rows."
+
+
+def show_rows(rows):
+    view.display_table(None, [(field, field, None, show_value)
+                              for field in rows[0]], rows)
+
+
+def show_value(value):
+    return ', '.join(value) if isinstance(value, list) else value
+
+
+@input_error
+def explain_select(args=None):
+    if not args or not args.lower().startswith('select'):
+        raise ValueError("Please write a query after 'explain', e.g. "
+                         "explain select name from contacts")
+    steps = explain_query(args, address_book, notebook)
+    return '\n'.join(f"{number}. {step}"
+                     for number, step in enumerate(steps, 1))
+
+
+@input_error
+def verify_data():
+    problems = address_book.verify(notebook)
+    if not problems:
+        return (f"All {len(address_book)} contacts and {len(notebook)} "
+                "notes are valid.")
+    view.display_table(
+        f"\nFound {len(problems)} problems:",
+        [('owner', "Contact or note", 'magenta'), ('field', "Field", 'cyan'),
+         ('value', "Value", 'yellow'), ('problem', "Problem", 'red')],
+        [{'owner': owner, 'field': field, 'value': value, 'problem': error}
+         for owner, field, value, error in problems])
+    return ""
+
+
+@input_error
+def export_data():
+    kind = ask(
+        "What do you want to export: contacts or notes? ").strip().lower()
+    if kind not in ('contacts', 'notes'):
+        raise ValueError("Please enter 'contacts' or 'notes'.")
+    fmt = ask(
+        "Please enter the format (csv, vcard, jsonl): ").strip().lower()
+    filename = ask("Please enter the file name to export to: ").strip()
+    if not filename:
+        raise ValueError("Please specify the file name.")
+    query = ask("Only export items matching the text "
+                "(or nothing for all): ").strip()
+    if kind == 'contacts':
+        days = ask("Only export contacts with a birthday in the next "
+                   "number of days (or nothing for all): ").strip()
+        items = select_contacts(address_book, query, int(days) if days
+                                else None)
+    else:
+        tag = ask("Only export notes with the tag "
+                  "(or nothing for all): ").strip()
+        items = select_notes(notebook, query, tag)
+    count = export(filename, kind, fmt, items)
+    return f"Exported {count} {kind} to {filename}."
+
+
 commands = {
     "hello": hello,
     "help": help,
@@ -701,14 +1194,22 @@ commands = {
     "remove phone": remove_phone_from_contact,
     "remove email": remove_email_from_contact,
     "remove address": remove_address_from_contact,
-    "clear all": address_book.clear_all_contacts,
+    "clear all": clear_all_contacts,
     "search by birthday": search_contact_by_birthday,
     "days to birthday": when_birthday,
+    "birthday digest": birthday_digest,
+    "birthdays by month": birthdays_by_month,
+    "who turns": who_turns,
     "delete contact": delete_contact,
+    "dedupe contacts": dedupe_contacts,
     "search": search_contacts,
+    "email domains": email_domains,
     "find phone": get_phone,
+    "phone owner": get_phone_owner,
     "show all contacts": show_all_contacts,
     "sort folder": sort_folder,
+    "watch folder": watch_folder,
+    "stop watching": stop_watching,
     "create note": create_note,
     "change title": change_note_title,
     'add tags': add_tag,
@@ -720,6 +1221,19 @@ commands = {
     "find tags": find_notes_by_tags,
     "sort notes": sort_notes_by_tags,
     "delete tags": remove_tag,
+    "bulk add tags": bulk_add_tags,
+    "bulk delete tags": bulk_remove_tags,
+    "bulk delete notes": bulk_delete_notes,
+    "bulk delete contacts": bulk_delete_contacts,
+    "bulk remove phones": bulk_remove_phones,
+    "note history": show_note_history,
+    "note revert": revert_note,
+    "export": export_data,
+    "stats": show_stats,
+    "report": show_report,
+    "verify": verify_data,
+    "select": select_query,
+    "explain": explain_select,
     "good bye": exit_bot,
     "close": exit_bot,
     "exit": exit_bot,
@@ -727,33 +1241,97 @@ commands = {
 }
 
 
+def run_command(data):
+    """Runs one line typed at the prompt, prints and returns its result."""
+    func, args = choice_action(data, commands)
+    # Held while the command runs, except while it waits for an answer
+    with address_book.lock:
+        result = func(args) if args else func()
+    view.display_message(result)
+    if recorder is not None:
+        recorder.command(data)
+    return result
+
+
 def choice_action(data, commands):
+    # Commands are matched ignoring case; their arguments keep it
     for command in commands:
-        if data.startswith(command):
+        if data.lower().startswith(command):
             args = data[len(command):].strip()
             return commands[command], args if args else None
     return unknown_command, None
 
 
 def main():
-
-    filename = input(
+    global view, answer_session, recorder
+    output = os.environ.get(OUTPUT_VARIABLE, 'console').lower()
+    if output not in INTERFACES:
+        raise SystemExit(f"{OUTPUT_VARIABLE} should be one of: "
+                         + ', '.join(INTERFACES))
+    view = INTERFACES[output]()
+    # The console prompts need a terminal; other views read plain lines
+    interactive = isinstance(view, ConsoleInterface)
+
+    filename = view.ask(
         "Please enter the filename to load/create "
         "the Personal Assistant: ").strip()
 
+    client = connect(filename)
+    if client is not None:
+        # A server already holds this file: work through it instead of
+        # loading a private copy that would overwrite its changes.
+        run_session(client, view, output)
+        return
+
+    address_book.report = view.display_message
     address_book.load_from_disk(filename, notebook)
-    print("\nWelcome to Your Personal Assistant!\n",
-          "Type 'help' to see available commands and instructions.")
-    session = PromptSession(
-        lexer=PygmentsLexer(SqlLexer), completer=sql_completer)
-    while True:
-        data = session.prompt("\nPlease enter the command: ").lower().strip()
-        func, args = choice_action(data, commands)
-        result = func(args) if args else func()
-        print(result)
-        if result == "Good bye!":
-            address_book.save_to_disk(filename, notebook)
-            break
+    autosaver = AutoSaver(address_book, notebook, filename)
+    autosaver.start()
+    # Upcoming birthdays are announced above the prompt when they are due
+    reminders = ReminderScheduler(address_book, report=view.display_message)
+    reminders.start()
+    if hasattr(signal, 'SIGHUP'):
+        # A closed terminal ends the session like Ctrl-C does
+        signal.signal(signal.SIGHUP, signal.default_int_handler)
+    view.display_message(
+        "\nWelcome to Your Personal Assistant!\n"
+        " Type 'help' to see available commands and instructions.")
+    if interactive:
+        session = PromptSession(
+            lexer=PygmentsLexer(SqlLexer), completer=sql_completer)
+        answer_session = PromptSession()
+    if os.environ.get(RECORD_VARIABLE):
+        # Commands and answers are kept for personal-assistant-replay
+        recorder = SessionRecorder(os.environ[RECORD_VARIABLE])
+    try:
+        while True:
+            # Messages from background threads appear above the prompt
+            if interactive:
+                with patch_stdout(raw=True):
+                    data = session.prompt(
+                        "\nPlease enter the command: ").strip()
+            else:
+                data = view.ask("\nPlease enter the command: ").strip()
+                if recorder is not None:
+                    # The command line is not an answer to its questions
+                    recorder.answers.clear()
+            if address_book.reload_if_changed(notebook):
+                view.display_message(
+                    f"{filename} was changed by another session, "
+                    "its changes have been loaded.")
+            result = run_command(data)
+            if result == "Good bye!":
+                address_book.save_to_disk(filename, notebook)
+                break
+    except (KeyboardInterrupt, EOFError):
+        view.display_message("Good bye!")
+    finally:
+        for watcher in list(folder_watchers.values()):
+            watcher.stop()
+        reminders.stop()
+        autosaver.stop()
+        if recorder is not None:
+            recorder.close()
 
 
 if __name__ == "__main__":
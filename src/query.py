@@ -0,0 +1,471 @@
+from collections import namedtuple
+import heapq
+import re
+
+from src.birthdays import parse_birthday
+from src.classes import Phone
+
+
+class QueryError(ValueError):
+    """Raised for a query that cannot be parsed or run."""
+
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^']|'')*')
+    |(?P<number>\d+)
+    |(?P<word>[^\W\d]\w*)
+    |(?P<symbol><=|>=|!=|<>|[=<>,*])
+)""", re.VERBOSE)
+
+KEYWORDS = {'select', 'from', 'where', 'and', 'order', 'by', 'asc', 'desc',
+            'limit', 'like', 'within', 'days', 'match'}
+
+# How each field of a contact or a note is read. List fields match
+# a condition if any of their items do.
+SOURCES = {
+    'contacts': {
+        'name': lambda record: record.name.value,
+        'phones': lambda record: [phone.value for phone in record.phones],
+        'emails': lambda record: [email.value for email in record.emails],
+        'addresses': lambda record: [
+            address.value for address in record.addresses],
+        'birthday': lambda record: (
+            record.birthday.value if record.birthday else None),
+    },
+    'notes': {
+        'title': lambda note: note.title.value,
+        'author': lambda note: note.author.value,
+        'tags': lambda note: (note.tags if isinstance(note.tags, str)
+                              else ', '.join(note.tags)),
+        'created_at': lambda note: note.created_at.strftime(
+            '%Y-%m-%d %H:%M:%S'),
+        'preview': lambda note: note.preview,
+        'body': lambda note: note.body,
+    },
+}
+# Fields that only appear in conditions
+CONDITION_FIELDS = {'contacts': set(), 'notes': {'text'}}
+# Other names accepted for the list fields
+FIELD_ALIASES = {
+    'contacts': {'phone': 'phones', 'email': 'emails',
+                 'address': 'addresses'},
+    'notes': {'tag': 'tags'},
+}
+
+COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+Query = namedtuple(
+    'Query', 'source fields conditions order_by descending limit')
+Condition = namedtuple('Condition', 'field op value')
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip().rstrip(';')
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise QueryError(f"Cannot understand the query at "
+                             f"'{text[position:].strip()[:20]}'")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'word' and value.lower() in KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        elif kind == 'word':
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    """class for turning the text of a query into a Query"""
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def take(self, kind=None, value=None):
+        token_kind, token_value = self.peek()
+        if token_kind is None or (kind and token_kind != kind) \
+                or (value is not None and token_value != value):
+            expected = value or kind or 'more'
+            found = token_value if token_kind else 'the end of the query'
+            raise QueryError(f"Expected {expected}, found {found}")
+        self.position += 1
+        return token_value
+
+    def accept(self, kind, value):
+        if self.peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        self.take('keyword', 'select')
+        fields = []
+        if self.accept('symbol', '*'):
+            fields = None
+        else:
+            fields.append(self.take('word'))
+            while self.accept('symbol', ','):
+                fields.append(self.take('word'))
+        self.take('keyword', 'from')
+        source = self.take('word')
+        if source not in SOURCES:
+            raise QueryError(f"Unknown source {source}. "
+                             f"Use {' or '.join(SOURCES)}.")
+        known = SOURCES[source]
+        fields = [self.alias(source, field) for field in fields or known]
+        for field in fields:
+            if field not in known:
+                raise QueryError(f"Unknown field {field} of {source}. "
+                                 f"Fields: {', '.join(known)}")
+        conditions = []
+        if self.accept('keyword', 'where'):
+            conditions.append(self.condition(source))
+            while self.accept('keyword', 'and'):
+                conditions.append(self.condition(source))
+        order_by, descending = None, False
+        if self.accept('keyword', 'order'):
+            self.take('keyword', 'by')
+            order_by = self.alias(source, self.take('word'))
+            if order_by not in known:
+                raise QueryError(f"Cannot order {source} by {order_by}")
+            descending = self.accept('keyword', 'desc')
+            if not descending:
+                self.accept('keyword', 'asc')
+        limit = None
+        if self.accept('keyword', 'limit'):
+            limit = int(self.take('number'))
+        if self.peek()[0] is not None:
+            raise QueryError(f"Unexpected {self.peek()[1]} in the query")
+        return Query(source, fields, conditions, order_by, descending, limit)
+
+    @staticmethod
+    def alias(source, field):
+        return FIELD_ALIASES[source].get(field, field)
+
+    def condition(self, source):
+        field = self.alias(source, self.take('word'))
+        if field not in SOURCES[source] \
+                and field not in CONDITION_FIELDS[source]:
+            raise QueryError(f"Unknown field {field} of {source}")
+        kind, op = self.peek()
+        if kind == 'symbol' and op in ('=', '!=', '<>', '<', '<=', '>', '>='):
+            self.position += 1
+            op = '!=' if op == '<>' else op
+            return Condition(field, op, self.value())
+        if self.accept('keyword', 'like'):
+            return Condition(field, 'like', self.value())
+        if self.accept('keyword', 'match'):
+            if field not in ('text', 'addresses'):
+                raise QueryError(
+                    "Only 'text match' and 'addresses match' are supported")
+            return Condition(field, 'match', self.value())
+        if self.accept('keyword', 'within'):
+            if field != 'birthday':
+                raise QueryError("Only 'birthday within N days' is supported")
+            number = int(self.take('number'))
+            self.accept('keyword', 'days')
+            return Condition(field, 'within', number)
+        raise QueryError(f"Expected a comparison after {field}")
+
+    def value(self):
+        kind, value = self.peek()
+        if kind not in ('string', 'number'):
+            raise QueryError(f"Expected a value, found {value}")
+        self.position += 1
+        return value
+
+
+def parse(text):
+    return Parser(text).parse()
+
+
+def like_pattern(pattern):
+    # SQL LIKE: % is any text, _ is any single character
+    parts = ('.*' if char == '%' else '.' if char == '_' else re.escape(char)
+             for char in pattern)
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+
+def literal_prefix(pattern):
+    """Returns the text before the first wildcard of a LIKE pattern."""
+    match = re.match(r'[^%_]*', pattern)
+    return match.group(0)
+
+
+def email_scope(pattern):
+    """
+    Returns what the email index can look up for a LIKE pattern:
+    '@corp.ua' for '%@corp.ua', 'anna@' for 'anna@%', else None.
+    """
+    match = re.fullmatch(r'%@([^%_@]+)|([^%_@]+)@%', pattern)
+    if match is None:
+        return None
+    domain, local = match.groups()
+    return f"@{domain}" if domain else f"{local}@"
+
+
+def canonical_phone(value):
+    try:
+        return Phone(value).canonical
+    except ValueError:
+        return None
+
+
+class Planner:
+    """
+    class for choosing how a query is answered
+
+    Every condition that an index can answer is costed: an exact key is
+    cheapest, then a prefix range of a sorted index, then the birthday
+    day buckets and the note search index. The cheapest one supplies the
+    candidates and every condition is then checked on them one by one,
+    so results stream out without building the whole answer. Without a
+    usable index the whole collection is scanned.
+    """
+
+    def __init__(self, address_book, notebook):
+        self.address_book = address_book
+        self.notebook = notebook
+
+    # Index access paths: return (cost, description, candidates function,
+    # field the candidates are sorted by or None), or None if the
+    # condition cannot use an index
+
+    def contacts_paths(self, condition):
+        book = self.address_book
+        field, op, value = condition
+        if field == 'name' and op == '=':
+            return (0, f"name index lookup '{value}'",
+                    lambda: [book.data[name]
+                             for name in book.names.starting_with(value, None)
+                             if name.lower() == value.lower()], None)
+        if field == 'name' and op == 'like' and literal_prefix(value):
+            prefix = literal_prefix(value)
+            return (1, f"name index range '{prefix}'",
+                    lambda: [book.data[name] for name in
+                             book.names.starting_with(prefix, None)],
+                    'name')
+        if field == 'phones' and op == '=' and canonical_phone(value):
+            number = canonical_phone(value)
+            return (0, f"phone index lookup {number}",
+                    lambda: sorted(book.phone_index.get(number, ()),
+                                   key=lambda record: record.name.value), None)
+        if field == 'phones' and op == 'like' and literal_prefix(value):
+            try:
+                prefix = Phone.normalize_prefix(literal_prefix(value))
+            except ValueError:
+                return None
+            return (1, f"phone prefix index range {prefix}",
+                    lambda: book.select_contacts(
+                        phone_prefix=literal_prefix(value)), None)
+        if field == 'emails' and op == '=' and '@' in value:
+            return (0, f"email index lookup {value.lower()}",
+                    lambda: book.find_by_email(value), None)
+        if field == 'emails' and op == 'like' and email_scope(value):
+            scope = email_scope(value)
+            return (1, f"email index lookup {scope}",
+                    lambda: book.find_by_email(scope), None)
+        if field == 'addresses' and op == 'match':
+            return (2, f"address index words '{value}'",
+                    lambda: book.find_by_address(value), None)
+        if field == 'birthday' and op == 'within':
+            return (2, f"birthday index, next {value} days",
+                    lambda: book.search_by_birthday(value), None)
+        return None
+
+    def notes_paths(self, condition):
+        notebook = self.notebook
+        field, op, value = condition
+        if field == 'title' and op == '=':
+            return (0, f"title index lookup '{value}'",
+                    lambda: [notebook.data[title] for title in
+                             notebook.titles.starting_with(value, None)
+                             if title.lower() == value.lower()], None)
+        if field == 'title' and op == 'like' and literal_prefix(value):
+            prefix = literal_prefix(value)
+            return (1, f"title index range '{prefix}'",
+                    lambda: [notebook.data[title] for title in
+                             notebook.titles.starting_with(prefix, None)],
+                    'title')
+        if field == 'text' and op == 'match':
+            return (3, f"search index words '{value}'",
+                    lambda: notebook.select_notes(value), None)
+        if field == 'tags' and op == '=':
+            return (3, f"search index tag {value}",
+                    lambda: notebook.select_notes(tags=[value]), None)
+        return None
+
+    def scan(self, query):
+        """Reads the whole collection, in name or title order if asked."""
+        if query.source == 'contacts':
+            book = self.address_book
+            if query.order_by == 'name':
+                return ("name index in order",
+                        lambda: [book.data[name] for name in
+                                 book.names.starting_with('', None)], 'name')
+            return ("full scan of contacts",
+                    lambda: list(book.data.values()), None)
+        notebook = self.notebook
+        if query.order_by == 'title':
+            return ("title index in order",
+                    lambda: [notebook.data[title] for title in
+                             notebook.titles.starting_with('', None)],
+                    'title')
+        return ("full scan of notes",
+                lambda: list(notebook.data.values()), None)
+
+    def predicate(self, source, condition):
+        """Returns a function telling whether an item meets the condition."""
+        field, op, value = condition
+        if op == 'within':
+            upcoming = set(self.address_book.search_by_birthday(value))
+            return lambda record: record in upcoming
+        if op == 'match' and source == 'contacts':
+            found = set(self.address_book.find_by_address(value))
+            return lambda record: record in found
+        if op == 'match':
+            titles = {note.title.value
+                      for note in self.notebook.select_notes(value)}
+            return lambda note: note.title.value in titles
+        read = SOURCES[source][field]
+        if field == 'phones' and op in ('=', '!=') and canonical_phone(value):
+            number = canonical_phone(value)
+            found = (lambda record: any(phone.canonical == number
+                                        for phone in record.phones))
+            return found if op == '=' else (lambda record: not found(record))
+        if field == 'phones' and op == 'like':
+            patterns = [like_pattern(value)]
+            prefix = literal_prefix(value)
+            try:
+                # '067%' also matches +38067..., as in the prefix index
+                patterns.append(like_pattern(
+                    Phone.normalize_prefix(prefix) + value[len(prefix):]))
+            except ValueError:
+                pass
+            return lambda record: any(
+                pattern.fullmatch(phone.value)
+                or pattern.fullmatch(phone.canonical)
+                for pattern in patterns for phone in record.phones)
+        if field == 'tags' and op in ('=', '!='):
+            tag = value if value.startswith('#') else '#' + value
+            found = (lambda note: tag.lower() in
+                     read(note).lower().split(', '))
+            return found if op == '=' else (lambda note: not found(note))
+        pattern = like_pattern(value) if op == 'like' else None
+        value = value.lower()
+
+        def test(item):
+            if pattern is not None:
+                return pattern.fullmatch(item) is not None
+            return COMPARISONS[op](item.lower(), value)
+
+        def check(item):
+            found = read(item)
+            if isinstance(found, list):
+                if op == '!=':
+                    return all(test(part) for part in found)
+                return any(test(part) for part in found)
+            return found is not None and test(found)
+        return check
+
+    def plan(self, query):
+        """
+        Returns (description, candidates function, field the candidates
+        are sorted by) for the query.
+        """
+        paths = self.contacts_paths if query.source == 'contacts' \
+            else self.notes_paths
+        best = None
+        for condition in query.conditions:
+            path = paths(condition)
+            if path is not None and (best is None or path[0] < best[0]):
+                best = path
+        if best is None:
+            return self.scan(query)
+        return best[1:]
+
+    def explain(self, query):
+        description, _, ordered_by = self.plan(query)
+        steps = [f"read {query.source} by {description}"]
+        if query.conditions:
+            steps.append(f"check {len(query.conditions)} condition(s) "
+                         "on each candidate")
+        if query.order_by and query.order_by == ordered_by:
+            steps.append(f"already in {query.order_by} order" + (
+                f", stop after {query.limit} rows" if query.limit else ""))
+        elif query.order_by and query.limit:
+            steps.append(f"keep the {query.limit} "
+                         f"{'largest' if query.descending else 'smallest'} "
+                         f"by {query.order_by} in a heap")
+        elif query.order_by:
+            steps.append(f"sort by {query.order_by}")
+        elif query.limit:
+            steps.append(f"stop after {query.limit} rows")
+        return steps
+
+    def run(self, query):
+        """Yields the result rows of the query as dictionaries."""
+        _, candidates, ordered_by = self.plan(query)
+        checks = [self.predicate(query.source, condition)
+                  for condition in query.conditions]
+        found = candidates()
+        if query.order_by and query.order_by == ordered_by \
+                and query.descending:
+            found = reversed(found)
+        items = (item for item in found
+                 if all(check(item) for check in checks))
+        if query.order_by and query.order_by != ordered_by:
+            read = SOURCES[query.source][query.order_by]
+
+            def key(item):
+                value = read(item)
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                # Items without a value come last in either direction
+                last = query.descending
+                if query.order_by == 'birthday':
+                    # By date of birth, not by the text of the date
+                    parsed = parse_birthday(value) if value else None
+                    return ((parsed is None) != last, parsed and parsed[::-1])
+                return ((value is None) != last, (value or '').lower())
+            if query.limit is not None:
+                select = heapq.nlargest if query.descending \
+                    else heapq.nsmallest
+                items = select(query.limit, items, key=key)
+            else:
+                items = sorted(items, key=key, reverse=query.descending)
+        fields = [(field, SOURCES[query.source][field])
+                  for field in query.fields]
+        for count, item in enumerate(items):
+            if query.limit is not None and count >= query.limit:
+                return
+            yield {field: read(item) for field, read in fields}
+
+
+def run_query(text, address_book, notebook):
+    """Parses the query and yields its rows."""
+    return Planner(address_book, notebook).run(parse(text))
+
+
+def explain_query(text, address_book, notebook):
+    """Returns the steps the planner would take for the query."""
+    return Planner(address_book, notebook).explain(parse(text))
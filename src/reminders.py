@@ -0,0 +1,169 @@
+from datetime import date, datetime, time, timedelta
+import calendar
+import functools
+import heapq
+import itertools
+import threading
+
+from src.birthdays import parse_birthday
+
+# Reminders are given this many days before the birthday, at REMIND_AT
+REMIND_DAYS_BEFORE = 1
+REMIND_AT = time(9, 0)
+# Longest sleep between looks at the clock, so a changed system clock or
+# a suspended computer delays a reminder by at most this many seconds
+MAX_WAIT = 3600
+
+
+def next_birthday(day, month, today):
+    """The date of the first birthday on or after today."""
+    for year in (today.year, today.year + 1):
+        if month == 2 and day == 29 and not calendar.isleap(year):
+            found = date(year, 2, 28)
+        else:
+            found = date(year, month, day)
+        if found >= today:
+            return found
+
+
+@functools.lru_cache(maxsize=1024)
+def reminder_dates(day, month, after, days_before):
+    """
+    Returns (birthday, reminder time) for the first birthday on or after
+    `after`. There are only 366 birthdays in a year, so a whole book
+    shares a few hundred answers.
+    """
+    upcoming = next_birthday(day, month, after)
+    return upcoming, datetime.combine(
+        upcoming - timedelta(days=days_before), REMIND_AT)
+
+
+class ReminderScheduler(threading.Thread):
+    """
+    class for reminding about birthdays during a session
+
+    Keeps a min-heap of (reminder time, entry) with one live entry per
+    contact that has a birthday. The thread sleeps until the earliest
+    reminder is due, prints it and files the contact's next birthday.
+    The address book calls update() and remove() as contacts change, so
+    the heap is never rebuilt: a changed contact pushes a new entry and
+    its old one is skipped when it reaches the top.
+    """
+
+    def __init__(self, address_book, report=print,
+                 days_before=REMIND_DAYS_BEFORE):
+        super().__init__(name='birthday reminders', daemon=True)
+        self.report = report
+        self.days_before = days_before
+        self.heap = []
+        # Record -> (number of its live entry, birthday, name)
+        self.scheduled = {}
+        self.numbers = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.address_book = address_book
+
+    def _build(self):
+        # Runs in the thread, so a large book does not hold up the prompt.
+        # Changes wait for the lock and are then passed to update().
+        with self.address_book.lock, self.condition:
+            index = self.address_book.birthdays
+            today = date.today()
+            for record, slot in index.slots.items():
+                self._schedule(record, (index.days[slot], index.months[slot],
+                                        index.years[slot]), today)
+            heapq.heapify(self.heap)
+            self.address_book.reminders = self
+
+    def _schedule(self, record, birthday, after, push=list.append):
+        """Files the reminder for the first birthday on or after `after`."""
+        day, month, year = birthday
+        number = next(self.numbers)
+        self.scheduled[record] = number, birthday, record.name.value
+        upcoming, remind_at = reminder_dates(day, month, after,
+                                             self.days_before)
+        push(self.heap, (remind_at, number, record, record.name.value,
+                         upcoming, year))
+
+    def update(self, record):
+        value = record.birthday.value if record.birthday else None
+        birthday = parse_birthday(value) if value else None
+        with self.condition:
+            current = self.scheduled.get(record)
+            if birthday is None:
+                self.scheduled.pop(record, None)
+                return
+            if current is not None \
+                    and current[1:] == (birthday, record.name.value):
+                return
+            self._schedule(record, birthday, date.today(), heapq.heappush)
+            if len(self.heap) > 2 * len(self.scheduled) + 1000:
+                self._compact()
+            self.condition.notify()
+
+    def remove(self, record):
+        with self.condition:
+            self.scheduled.pop(record, None)
+
+    def clear(self):
+        with self.condition:
+            self.scheduled.clear()
+            self.heap.clear()
+
+    def _compact(self):
+        # Drops the entries of changed and deleted contacts
+        self.heap = [entry for entry in self.heap
+                     if self._is_live(entry)]
+        heapq.heapify(self.heap)
+
+    def _is_live(self, entry):
+        current = self.scheduled.get(entry[2])
+        return current is not None and current[0] == entry[1]
+
+    def _pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self._is_live(entry):
+                continue
+            due.append(entry)
+            record, upcoming = entry[2], entry[4]
+            self._schedule(record, self.scheduled[record][1],
+                           upcoming + timedelta(days=1), heapq.heappush)
+        return due
+
+    def message(self, entry, today=None):
+        _, _, _, name, upcoming, year = entry
+        days = (upcoming - (today or date.today())).days
+        when = 'today' if days == 0 else 'tomorrow' if days == 1 \
+            else f"in {days} days"
+        return (f"Reminder: {name}'s birthday is {when}, "
+                f"{upcoming.strftime('%d.%m')} "
+                f"(turns {upcoming.year - year}).")
+
+    def run(self):
+        self._build()
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                due = self._pop_due(datetime.now())
+                if not due:
+                    wait = MAX_WAIT
+                    if self.heap:
+                        wait = min(wait, max((self.heap[0][0] - datetime.now())
+                                             .total_seconds(), 0))
+                    self.condition.wait(wait)
+                    continue
+            for entry in due:
+                self.report(self.message(entry))
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+        with self.address_book.lock:
+            if self.address_book.reminders is self:
+                self.address_book.reminders = None
@@ -0,0 +1,186 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from src import main as assistant
+from src.classes import Record, Note
+from src.session import ScriptedInput, read_session
+
+FIRST_NAMES = ['Anna', 'Olena', 'Iryna', 'Maria', 'Oksana', 'Taras',
+               'Andrii', 'Dmytro', 'Serhii', 'Mykola', 'Ivan', 'Yulia']
+LAST_NAMES = ['Shevchenko', 'Kovalenko', 'Bondarenko', 'Tkachenko',
+              'Kravchenko', 'Melnyk', 'Boiko', 'Moroz', 'Lysenko']
+DOMAINS = ['gmail.com', 'ukr.net', 'corp.ua', 'example.com']
+STREETS = ['Khreshchatyk', 'Sahaidachnoho', 'Antonovycha',
+           'Velyka Zhytomyrska']
+WORDS = ['meeting', 'project', 'python', 'budget', 'report', 'travel',
+         'family', 'shopping', 'idea', 'plan', 'review', 'deadline']
+TAGS = ['#work', '#home', '#ideas', '#travel', '#todo']
+
+PERCENTILES = (50, 90, 99)
+
+
+def fill_book(address_book, notebook, contacts, notes, seed=0):
+    """
+    Fills the books with made-up contacts and notes. The same seed always
+    gives the same books, so replays can be compared with each other.
+    """
+    rng = random.Random(seed)
+    for i in range(contacts):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+        record = Record(name, f"{rng.randint(1, 28):02d}."
+                              f"{rng.randint(1, 12):02d}."
+                              f"{rng.randint(1950, 2010)}")
+        record.add_phone(f"0{rng.choice([50, 63, 67, 93, 97])}"
+                         f"{rng.randint(0, 9999999):07d}")
+        if rng.random() < 0.7:
+            record.add_email(f"user{i}@{rng.choice(DOMAINS)}")
+        if rng.random() < 0.5:
+            record.add_address(f"{rng.choice(STREETS)} {rng.randint(1, 99)}, "
+                               "Kyiv")
+        address_book.add_record(record)
+    for i in range(notes):
+        body = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 60)))
+        notebook.add_note(Note(rng.choice(FIRST_NAMES), f"Note {i}", body,
+                               rng.sample(TAGS, rng.randint(0, 2))))
+
+
+def percentile(ordered, p):
+    """The p-th percentile of a sorted list, by the nearest rank."""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies, seconds):
+    ordered = sorted(latencies)
+    return dict(
+        commands=len(ordered),
+        commands_per_second=len(ordered) / seconds if seconds else 0.0,
+        **{f"p{p}_ms": percentile(ordered, p) * 1000 for p in PERCENTILES},
+        max_ms=(ordered[-1] * 1000) if ordered else 0.0)
+
+
+def command_name(data):
+    """The command a line runs, without its arguments."""
+    return next((command for command in assistant.commands
+                 if data.lower().startswith(command)), 'unknown')
+
+
+def replay(sessions, repeat=1):
+    """
+    Runs the recorded sessions `repeat` times through the same code as
+    the prompt loop, with answers taken from the recording and output
+    rendered but thrown away. Returns the report as a dictionary.
+    """
+    latencies = {}
+    errors = 0
+    output = io.StringIO()
+    started = time.perf_counter()
+    with ScriptedInput() as answers, contextlib.redirect_stdout(output):
+        for _ in range(repeat):
+            for session in sessions:
+                for data, recorded in session:
+                    answers.answers = list(recorded)
+                    began = time.perf_counter()
+                    try:
+                        assistant.run_command(data)
+                    except Exception:
+                        errors += 1
+                    elapsed = time.perf_counter() - began
+                    latencies.setdefault(command_name(data), []).append(
+                        elapsed)
+                    # Keep the output rendered but not piling up
+                    output.seek(0)
+                    output.truncate()
+    seconds = time.perf_counter() - started
+    every = [latency for found in latencies.values() for latency in found]
+    return dict(summarize(every, seconds), seconds=seconds, errors=errors,
+                by_command={command: summarize(found, sum(found))
+                            for command, found in sorted(latencies.items())})
+
+
+def format_report(report):
+    rows = [[command, stats['commands'], f"{stats['p50_ms']:.3f}",
+             f"{stats['p90_ms']:.3f}", f"{stats['p99_ms']:.3f}",
+             f"{stats['max_ms']:.3f}"]
+            for command, stats in report['by_command'].items()]
+    rows.append(['all', report['commands'], f"{report['p50_ms']:.3f}",
+                 f"{report['p90_ms']:.3f}", f"{report['p99_ms']:.3f}",
+                 f"{report['max_ms']:.3f}"])
+    table = tabulate(rows, headers=["Command", "Runs", "p50 ms", "p90 ms",
+                                    "p99 ms", "max ms"],
+                     tablefmt="fancy_grid")
+    return (f"{table}\n{report['commands']} commands in "
+            f"{report['seconds']:.2f} s: "
+            f"{report['commands_per_second']:.1f} commands/s, "
+            f"{report['errors']} errors")
+
+
+def main():
+    """
+    Usage: personal-assistant-replay <session file> ... [options]
+    Replays sessions recorded with PERSONAL_ASSISTANT_RECORD=<file> and
+    reports commands per second and latency percentiles.
+    """
+    parser = argparse.ArgumentParser(
+        prog='personal-assistant-replay',
+        description="Replay recorded sessions and measure the command loop.")
+    parser.add_argument('sessions', nargs='+', help="recorded session files")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="how many times to replay the sessions")
+    parser.add_argument('--book', help="data file to replay against "
+                        "(a copy is used); by default a made-up book")
+    parser.add_argument('--contacts', type=int, default=1000,
+                        help="contacts in the made-up book")
+    parser.add_argument('--notes', type=int, default=1000,
+                        help="notes in the made-up book")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', choices=sorted(assistant.INTERFACES),
+                        default='console',
+                        help="view that renders the results")
+    parser.add_argument('--json', action='store_true',
+                        help="print the report as JSON")
+    options = parser.parse_args()
+
+    sessions = [read_session(filename) for filename in options.sessions]
+    assistant.view = assistant.INTERFACES[options.output]()
+    folder = tempfile.mkdtemp(prefix='replay-')
+    filename = os.path.join(folder, 'replay.data')
+    address_book, notebook = assistant.address_book, assistant.notebook
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if options.book:
+                # The note bodies are kept next to it in <book>.notes.*
+                shutil.copy(options.book, filename)
+                for body_file in glob.glob(glob.escape(options.book)
+                                           + '.notes.*'):
+                    shutil.copy(body_file, filename + body_file[
+                        len(options.book):])
+            else:
+                fill_book(address_book, notebook, options.contacts,
+                          options.notes, options.seed)
+                address_book.save_to_disk(filename, notebook)
+            # Changes made by the sessions are saved to the copy
+            address_book.load_from_disk(filename, notebook)
+        report = replay(sessions, options.repeat)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
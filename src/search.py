@@ -0,0 +1,166 @@
+from bisect import bisect_left
+from collections import Counter
+import heapq
+import math
+import re
+
+# Fields of a note searched by find_notes and how much a match counts
+FIELDS = ('title', 'tags', 'author', 'body')
+WEIGHTS = (3.0, 2.0, 1.5, 1.0)
+
+# BM25 parameters: term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def note_fields(note):
+    tags = note.tags if isinstance(note.tags, str) else ' '.join(note.tags)
+    return (note.title.value, tags, note.author.value, note.body)
+
+
+class NoteSearchIndex:
+    """
+    class for ranking notes with BM25F
+
+    An inverted index from each word to the notes containing it and how
+    often it occurs in each field. Scores combine the fields with WEIGHTS
+    and normalize by field length, and only the best k notes are kept
+    in a bounded heap. Adding or removing a note touches only its words.
+    """
+
+    def __init__(self):
+        # Per field: word -> {title: occurrences of the word in the field}
+        self.postings = [{} for _ in FIELDS]
+        self.document_count = {}  # Word -> number of notes containing it
+        self.lengths = {}    # Title -> [words per field]
+        self.terms = {}      # Title -> set of its words
+        self.total_lengths = [0] * len(FIELDS)
+        self.words = []      # Sorted vocabulary for prefix matches
+        self.words_changed = False
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, note):
+        title = note.title.value
+        self.remove(title)
+        lengths = []
+        terms = set()
+        for field, text in enumerate(note_fields(note)):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            postings = self.postings[field]
+            for token, frequency in Counter(tokens).items():
+                counts = postings.get(token)
+                if counts is None:
+                    counts = postings[token] = {}
+                counts[title] = frequency
+            terms.update(tokens)
+        for token in terms:
+            count = self.document_count.get(token, 0)
+            if not count:
+                self.words_changed = True
+            self.document_count[token] = count + 1
+        self.lengths[title] = lengths
+        self.terms[title] = terms
+        for field, length in enumerate(lengths):
+            self.total_lengths[field] += length
+
+    def remove(self, title):
+        lengths = self.lengths.pop(title, None)
+        if lengths is None:
+            return
+        for field, length in enumerate(lengths):
+            self.total_lengths[field] -= length
+        for word in self.terms.pop(title):
+            for postings in self.postings:
+                counts = postings.get(word)
+                if counts and counts.pop(title, None) and not counts:
+                    del postings[word]
+            self.document_count[word] -= 1
+            if not self.document_count[word]:
+                del self.document_count[word]
+                self.words_changed = True
+
+    def _expand(self, token):
+        """The token itself if indexed, otherwise words starting with it."""
+        if token in self.document_count:
+            return [token]
+        if self.words_changed:
+            self.words = sorted(self.document_count)
+            self.words_changed = False
+        start = bisect_left(self.words, token)
+        end = bisect_left(self.words, token + '\uffff')
+        return self.words[start:end]
+
+    def statistics(self, query):
+        """
+        Returns (notes, total words per field, {word: notes containing
+        it}) for the words the query matches. Summed over several indexes
+        and passed to search(), they rank all their notes on one scale.
+        """
+        words = {word for token in set(tokenize(query))
+                 for word in self._expand(token)}
+        return (len(self.lengths), list(self.total_lengths),
+                {word: self.document_count[word] for word in words})
+
+    def search(self, query, k=10, statistics=None):
+        """
+        Returns up to k (score, title) pairs, best first. With statistics
+        of several indexes the scores are comparable across them.
+        """
+        if not self.lengths:
+            return []
+        count, total_lengths, document_count = statistics or (
+            len(self.lengths), self.total_lengths, self.document_count)
+        averages = [total / count or 1 for total in total_lengths]
+        scores = {}
+        for token in set(tokenize(query)):
+            for word in self._expand(token):
+                # Field-weighted, length-normalized occurrences per note
+                weighted = {}
+                for field, postings in enumerate(self.postings):
+                    weight, average = WEIGHTS[field], averages[field]
+                    for title, frequency in postings.get(word, {}).items():
+                        length = self.lengths[title][field]
+                        weighted[title] = weighted.get(title, 0) + (
+                            weight * frequency
+                            / (1 - B + B * length / average))
+                # A word saved since the statistics were taken counts
+                # as it does in this index
+                documents = document_count.get(
+                    word, self.document_count[word])
+                idf = math.log(
+                    1 + (count - documents + 0.5) / (documents + 0.5))
+                for title, value in weighted.items():
+                    scores[title] = scores.get(title, 0) + (
+                        idf * value / (K1 + value))
+        return heapq.nlargest(k, ((score, title)
+                                  for title, score in scores.items()))
+
+    def matching(self, query):
+        """
+        Returns the titles of all notes containing every word of the query
+        in any field. A word matches the indexed words starting with it.
+        """
+        result = None
+        for token in set(tokenize(query)):
+            titles = set()
+            for word in self._expand(token):
+                for postings in self.postings:
+                    titles.update(postings.get(word, ()))
+            result = titles if result is None else result & titles
+            if not result:
+                break
+        return result or set()
+
+    def tagged(self, tag):
+        """Returns the titles of the notes with a tag containing the word."""
+        titles = set()
+        for word in tokenize(tag):
+            titles.update(self.postings[FIELDS.index('tags')].get(word, ()))
+        return titles
@@ -0,0 +1,341 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import sys
+
+from src import main as assistant
+from src.classes import AddressBook, Notebook, Record, Note
+from src.classes import ConsoleInterface, JsonLinesInterface
+from src.client import default_socket_path
+from src.storage import AutoSaver
+from src.stats import collect_stats, collect_report
+from src.query import run_query
+
+
+class AnswerNeeded(BaseException):
+    """
+    Raised when a command run for a client asks a question it was not
+    sent the answer to. Not an Exception, so the handlers of the
+    commands let it through.
+    """
+
+    def __init__(self, question):
+        super().__init__(question)
+        self.question = question
+
+
+class ScriptedAnswers:
+    """
+    Mixin for the views of commands run for a client: questions are
+    answered from the request, and the first one without an answer
+    stops the command.
+    """
+
+    def __init__(self, answers):
+        super().__init__()
+        self.answers = list(answers)
+
+    def ask(self, message):
+        if not self.answers:
+            raise AnswerNeeded(message.strip())
+        return self.answers.pop(0)
+
+
+class RemoteConsoleInterface(ScriptedAnswers, ConsoleInterface):
+    """class for console output of a command run for a client"""
+
+
+class RemoteJsonLinesInterface(ScriptedAnswers, JsonLinesInterface):
+    """class for JSON-lines output of a command run for a client"""
+
+
+REMOTE_INTERFACES = {'console': RemoteConsoleInterface,
+                     'json': RemoteJsonLinesInterface}
+
+
+def as_list(value):
+    """Arguments given on the command line arrive as 'a,b' text."""
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return list(value)
+
+
+def socket_in_use(socket_path):
+    """Tells whether a server is accepting connections on the socket."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def note_to_response(note):
+    data = note.to_dict()
+    data['created_at'] = note.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    return data
+
+
+class AssistantServer:
+    """
+    A daemon that keeps one loaded AddressBook/Notebook in memory
+    and serves it to thin clients over a Unix-domain socket.
+
+    Changes are saved in the background by an AutoSaver.
+
+    The protocol is JSON lines: every request is a single line
+    {"op": "<operation>", "args": {...}} and every response is a single
+    line {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+    Requests are executed one at a time on the event loop, so concurrent
+    clients always see a consistent book.
+
+    The 'run' operation runs any command of the personal assistant, so
+    a session connected to the server has the same commands as a local
+    one.
+    """
+
+    def __init__(self, filename, socket_path=None):
+        self.filename = filename
+        self.socket_path = socket_path or default_socket_path(filename)
+        self.address_book = AddressBook()
+        self.notebook = Notebook()
+        self.autosaver = None
+        self.handlers = {
+            'ping': self.ping,
+            'commands': self.commands,
+            'run': self.run,
+            'lookup': self.lookup,
+            'search': self.search,
+            'phone_owner': self.phone_owner,
+            'search_by_birthday': self.search_by_birthday,
+            'add_contact': self.add_contact,
+            'add_phone': self.add_phone,
+            'add_email': self.add_email,
+            'add_address': self.add_address,
+            'delete_contact': self.delete_contact,
+            'create_note': self.create_note,
+            'find_notes': self.find_notes,
+            'show_note': self.show_note,
+            'list_notes': self.list_notes,
+            'add_tags': self.add_tags,
+            'find_tags': self.find_tags,
+            'delete_tags': self.delete_tags,
+            'save': self.save,
+            'stats': self.stats,
+            'report': self.report,
+            'query': self.query,
+        }
+
+    # Operations
+
+    def ping(self):
+        return {'contacts': len(self.address_book),
+                'notes': len(self.notebook)}
+
+    def commands(self):
+        return list(assistant.commands)
+
+    def run(self, command, answers=(), output='console'):
+        """
+        Runs a line typed at the prompt with the answers given so far to
+        its questions. Returns its output rendered for the client's view,
+        the question it stopped at (None when it finished) and its result.
+        The client sends the command again with one more answer for every
+        question, so nothing waits for the user while holding the book.
+        """
+        view = REMOTE_INTERFACES[output](answers)
+        saved = assistant.address_book, assistant.notebook, assistant.view
+        assistant.address_book, assistant.notebook = (
+            self.address_book, self.notebook)
+        assistant.view = view
+        buffer = io.StringIO()
+        question = result = None
+        try:
+            with contextlib.redirect_stdout(buffer):
+                result = assistant.run_command(command)
+        except AnswerNeeded as needed:
+            question = needed.question
+        finally:
+            assistant.address_book, assistant.notebook, assistant.view = saved
+        return {'output': buffer.getvalue(), 'question': question,
+                'result': result}
+
+    def _get_record(self, name):
+        record = self.address_book.find(name)
+        if record is None:
+            raise KeyError(f"Contact {name} not found")
+        return record
+
+    def lookup(self, name):
+        record = self.address_book.find(name)
+        return record.to_dict() if record else None
+
+    def search(self, query):
+        return [record.to_dict()
+                for record in self.address_book.search_contacts(query)]
+
+    def phone_owner(self, phone):
+        return [record.to_dict()
+                for record in self.address_book.find_by_phone(phone)]
+
+    def search_by_birthday(self, days):
+        return [record.to_dict()
+                for record in self.address_book.search_by_birthday(days)]
+
+    def add_contact(self, name, phones=(), emails=(), addresses=(),
+                    birthday=None):
+        if self.address_book.find(name):
+            raise ValueError(f"A contact with the name {name} already exists.")
+        record = Record(name, birthday)
+        for phone in as_list(phones):
+            record.add_phone(phone)
+        for email in as_list(emails):
+            record.add_email(email)
+        for address in as_list(addresses):
+            record.add_address(address)
+        self.address_book.add_record(record)
+        return record.to_dict()
+
+    def add_phone(self, name, phone):
+        return self._get_record(name).add_phone(phone)
+
+    def add_email(self, name, email):
+        return self._get_record(name).add_email(email)
+
+    def add_address(self, name, address):
+        return self._get_record(name).add_address(address)
+
+    def delete_contact(self, name):
+        self.address_book.delete(name)
+        return f"Contact {name} has been deleted."
+
+    def create_note(self, author, title, body, tags=''):
+        if self.notebook.get_note(title):
+            raise ValueError(f"Note '{title}' already exists.")
+        note = Note(author, title, body, self.notebook.tag_conversion(tags))
+        self.notebook.add_note(note)
+        return note_to_response(note)
+
+    def find_notes(self, query, k=10):
+        return [note_to_response(note)
+                for note in self.notebook.find_notes(query, int(k))]
+
+    def show_note(self, title):
+        note = self.notebook.get_note(title)
+        return note_to_response(note) if note else None
+
+    def list_notes(self):
+        return [note_to_response(note) for note in self.notebook.values()]
+
+    def add_tags(self, title, tags):
+        if title not in self.notebook:
+            raise KeyError(f"Note '{title}' not found")
+        self.notebook.add_tags(title, tags)
+        return self.notebook[title].tags
+
+    def find_tags(self, tag):
+        return [note_to_response(note)
+                for note in self.notebook.find_notes_by_tags(tag)]
+
+    def delete_tags(self, title, tags):
+        tags_to_remove = self.notebook.tag_conversion(tags).split(', ')
+        if not self.notebook.remove_tags(title, tags_to_remove):
+            raise KeyError(f"Note '{title}' not found")
+        return self.notebook[title].tags
+
+    def save(self):
+        self.address_book.save_to_disk(self.filename, self.notebook)
+        return f"Address book saved to {self.filename}"
+
+    def stats(self):
+        return collect_stats(self.address_book, self.notebook)
+
+    def report(self):
+        return collect_report(self.address_book, self.notebook)
+
+    def query(self, text):
+        return list(run_query(text, self.address_book, self.notebook))
+
+    # Transport
+
+    def dispatch(self, request):
+        try:
+            op = request['op']
+            handler = self.handlers[op]
+        except (KeyError, TypeError):
+            return {'ok': False, 'error': 'Unknown operation'}
+        try:
+            with self.address_book.lock:
+                result = handler(**request.get('args', {}))
+        except KeyError as ke:
+            return {'ok': False, 'error': str(ke.args[0]) if ke.args
+                    else 'Enter a correct information'}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True, 'result': result}
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {'ok': False, 'error': 'Malformed request'}
+                else:
+                    response = self.dispatch(request)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if socket_in_use(self.socket_path):
+            # Two servers would both write the file
+            raise SystemExit(f"A server is already serving {self.filename} "
+                             f"on {self.socket_path}.")
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # Left by a server that crashed
+        self.address_book.load_from_disk(self.filename, self.notebook)
+        self.autosaver = AutoSaver(
+            self.address_book, self.notebook, self.filename)
+        self.autosaver.start()
+        server = await asyncio.start_unix_server(
+            self.handle_client, path=self.socket_path)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        print(f"Serving {self.filename} on {self.socket_path}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            self.autosaver.stop()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            print("Server stopped.")
+
+
+def main():
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = input(
+            "Please enter the filename to serve "
+            "the Personal Assistant: ").strip()
+    asyncio.run(AssistantServer(filename).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import builtins
+import json
+
+# Set to a file name to record the commands of interactive sessions
+RECORD_VARIABLE = 'PERSONAL_ASSISTANT_RECORD'
+
+
+class SessionRecorder:
+    """
+    class for recording a session to be replayed later
+
+    Every command is written as one JSON line together with the answers
+    typed to its questions, in the order they were asked. Answers read
+    with input() are caught by replacing it while recording; answers read
+    by a prompt_toolkit prompt are passed in with answer().
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'a', encoding='utf-8')
+        self.answers = []
+        self.read_input = builtins.input
+        builtins.input = self.input
+
+    def input(self, prompt=''):
+        answer = self.read_input(prompt)
+        self.answers.append(answer)
+        return answer
+
+    def answer(self, text):
+        self.answers.append(text)
+
+    def command(self, data):
+        """Writes the command that just ran with the answers it was given."""
+        self.file.write(json.dumps({'command': data, 'answers': self.answers},
+                                   ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.answers = []
+
+    def close(self):
+        builtins.input = self.read_input
+        self.file.close()
+
+
+def read_session(filename):
+    """Returns the recorded (command, answers) pairs of a session file."""
+    with open(filename, encoding='utf-8') as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    return [(entry['command'], entry.get('answers', []))
+            for entry in entries]
+
+
+class ScriptedInput:
+    """
+    class for answering questions from a recorded session
+
+    Replaces input() while a session is replayed. A command that asks
+    more questions than were recorded gets EOFError, as it would at the
+    end of piped input.
+    """
+
+    def __init__(self):
+        self.answers = []
+        self.read_input = builtins.input
+
+    def __enter__(self):
+        builtins.input = self
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.input = self.read_input
+
+    def __call__(self, prompt=''):
+        if not self.answers:
+            raise EOFError("No recorded answer left")
+        return self.answers.pop(0)
@@ -23,122 +23,154 @@ def normalize(name):
     return f"{new_name}.{'.'.join(extension)}"
 
 
-images_files = list()
-video_files = list()
-doc_files = list()
-audio_files = list()
-archives = list()
-folders = list()
-others = list()
-known_extensions = set()
-unknown_extensions = set()
+class SortRun:
+    """
+    class for what one sort found
+
+    Every 'sort folder' and every batch of 'watch folder' gets a new one,
+    so the lists hold only that run's files and nothing piles up while a
+    folder is watched.
+    """
+
+    def __init__(self):
+        self.images_files = []
+        self.video_files = []
+        self.doc_files = []
+        self.audio_files = []
+        self.archives = []
+        self.folders = []
+        self.others = []
+        self.known_extensions = set()
+        self.unknown_extensions = set()
+        self.skipped = []  # Why files were left out
+
+    def summary(self):
+        text = (f"\nImages: {self.images_files}\n\n"
+                f"Video: {self.video_files}\n\n"
+                f"Documents: {self.doc_files}\n\n"
+                f"Audio: {self.audio_files}\n\n"
+                f"Archives: {self.archives}\n\n"
+                f"Unknown Extensions: {self.unknown_extensions}\n\n"
+                f"Others: {self.others}\n\n"
+                f"Known Extensions: {self.known_extensions}\n")
+        if self.skipped:
+            text += '\n' + '\n'.join(self.skipped) + '\n'
+        return text
 
 
 def create_directory(directory_path):
     os.makedirs(directory_path, exist_ok=True)
 
 
-def process_image(item, item_path, normalized_item, source_folder):
+def process_image(item, item_path, normalized_item, source_folder, run):
     images_folder = os.path.join(source_folder, 'images')
     create_directory(images_folder)
-    images_files.append(item)
-    known_extensions.add('image')
+    run.images_files.append(item)
+    run.known_extensions.add('image')
     dest_path = os.path.join(images_folder, normalized_item)
     shutil.move(item_path, dest_path)
 
 
-def process_video(item, item_path, normalized_item, source_folder):
+def process_video(item, item_path, normalized_item, source_folder, run):
     video_folder = os.path.join(source_folder, 'video')
     create_directory(video_folder)
-    video_files.append(item)
-    known_extensions.add('video')
+    run.video_files.append(item)
+    run.known_extensions.add('video')
     dest_path = os.path.join(video_folder, normalized_item)
     shutil.move(item_path, dest_path)
 
 
-def process_document(item, item_path, normalized_item, source_folder):
+def process_document(item, item_path, normalized_item, source_folder, run):
     documents_folder = os.path.join(source_folder, 'documents')
     create_directory(documents_folder)
-    doc_files.append(item)
-    known_extensions.add('document')
+    run.doc_files.append(item)
+    run.known_extensions.add('document')
     dest_path = os.path.join(documents_folder, normalized_item)
     shutil.move(item_path, dest_path)
 
 
-def process_audio(item, item_path, normalized_item, source_folder):
+def process_audio(item, item_path, normalized_item, source_folder, run):
     audio_folder = os.path.join(source_folder, 'audio')
     create_directory(audio_folder)
-    audio_files.append(item)
-    known_extensions.add('audio')
+    run.audio_files.append(item)
+    run.known_extensions.add('audio')
     dest_path = os.path.join(audio_folder, normalized_item)
     shutil.move(item_path, dest_path)
 
 
-def process_archive(item, item_path, normalized_item, source_folder):
+def process_archive(item, item_path, normalized_item, source_folder, run):
     archives_folder = os.path.join(source_folder, 'archives')
     create_directory(archives_folder)
-    archives.append(item)
-    known_extensions.add('archive')
+    run.archives.append(item)
+    run.known_extensions.add('archive')
     dest_path = os.path.join(
         archives_folder, normalized_item.rsplit('.', 1)[0])
     if zipfile.is_zipfile(item_path):
         with zipfile.ZipFile(item_path, 'r') as zip_ref:
             zip_ref.extractall(dest_path)
     else:
-        print(f"Skipping {item}: Not a valid zip file")
+        run.skipped.append(f"Skipping {item}: Not a valid zip file")
     os.remove(item_path)
 
 
-def process_other(item, item_path, normalized_item, source_folder):
+def process_other(item, item_path, normalized_item, source_folder, run):
     others_folder = os.path.join(source_folder, 'others')
     create_directory(others_folder)
-    unknown_extensions.add('other')
-    others.append(item)
+    run.unknown_extensions.add('other')
+    run.others.append(item)
     dest_path = os.path.join(others_folder, normalized_item)
     shutil.move(item_path, dest_path)
 
 
-def process_folder(folder, source_folder):
+PROCESSORS = {
+    'jpeg': process_image,
+    'png': process_image,
+    'jpg': process_image,
+    'svg': process_image,
+    'avi': process_video,
+    'mp4': process_video,
+    'mov': process_video,
+    'mkv': process_video,
+    'doc': process_document,
+    'docx': process_document,
+    'txt': process_document,
+    'pdf': process_document,
+    'xlsx': process_document,
+    'pptx': process_document,
+    'mp3': process_audio,
+    'ogg': process_audio,
+    'wav': process_audio,
+    'amr': process_audio,
+    'zip': process_archive,
+    'gz': process_archive,
+    'tar': process_archive
+}
+
+# Folders the sorted files are moved into
+CATEGORY_FOLDERS = ('images', 'video', 'documents', 'audio', 'archives',
+                    'others')
+
+
+def process_file(item, item_path, source_folder, run):
+    """Sorts one file into its category. Returns the processor used."""
+    extension = item.split('.')[-1].lower()
+    processor = PROCESSORS.get(extension, process_other)
+    processor(item, item_path, normalize(item), source_folder, run)
+    return processor
+
+
+def process_folder(folder, source_folder, run):
     for item in os.listdir(folder):
         item_path = os.path.join(folder, item)
-        normalized_item = normalize(item)
 
         if os.path.isfile(item_path):
-            extension = item.split('.')[-1].lower()
-
-            processors = {
-                'jpeg': process_image,
-                'png': process_image,
-                'jpg': process_image,
-                'svg': process_image,
-                'avi': process_video,
-                'mp4': process_video,
-                'mov': process_video,
-                'mkv': process_video,
-                'doc': process_document,
-                'docx': process_document,
-                'txt': process_document,
-                'pdf': process_document,
-                'xlsx': process_document,
-                'pptx': process_document,
-                'mp3': process_audio,
-                'ogg': process_audio,
-                'wav': process_audio,
-                'amr': process_audio,
-                'zip': process_archive,
-                'gz': process_archive,
-                'tar': process_archive
-            }
-
-            processor = processors.get(extension, process_other)
-            processor(item, item_path, normalized_item, source_folder)
+            process_file(item, item_path, source_folder, run)
 
         elif os.path.isdir(item_path):
             # Recursively process nested folders
-            if item not in ('images', 'video', 'documents', 'audio',
-                            'archives', 'others'):
-                process_folder(item_path, source_folder)
-                folders.append(item)
+            if item not in CATEGORY_FOLDERS:
+                process_folder(item_path, source_folder, run)
+                run.folders.append(item)
             else:
                 shutil.rmtree(item_path)
         else:
@@ -154,20 +186,22 @@ def remove_empty_folders(path):
                 os.rmdir(folder_path)
 
 
-def main(source_folder):
-
-    process_folder(source_folder, source_folder)
-    remove_empty_folders(source_folder)
+def prune_folder(path):
+    """
+    Removes the empty folders inside path and path itself if it is left
+    empty, without looking at the rest of the tree.
+    """
+    remove_empty_folders(path)
+    if not os.listdir(path):
+        os.rmdir(path)
 
-    print(f"\nImages: {images_files}\n")
-    print(f"Video: {video_files}\n")
-    print(f"Documents: {doc_files}\n")
-    print(f"Audio: {audio_files}\n")
-    print(f"Archives: {archives}\n")
-    print(f"Unknown Extensions: {unknown_extensions}\n")
-    print(f"Others: {others}\n")
-    print(f"Known Extensions: {known_extensions}\n")
 
+def main(source_folder):
+    """Sorts the folder. Returns a summary of what was found in it."""
+    run = SortRun()
+    process_folder(source_folder, source_folder, run)
+    remove_empty_folders(source_folder)
+    return run.summary()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,146 @@
+from collections import deque
+import calendar
+import heapq
+import random
+import sys
+import tracemalloc
+
+from src.classes import AddressBook, Notebook, Record, Note
+from src.storage import BlobStore
+
+# Contacts and notes are measured on a random sample of this size and
+# the result scaled up to the whole collection
+SAMPLE_SIZE = 1000
+
+# Most tags and authors listed by 'report'
+REPORT_LIMIT = 10
+
+# Objects that are measured on their own and never counted as part of
+# the structure that refers to them
+SHARED = (AddressBook, Notebook, BlobStore, Record, Note, type)
+
+
+def deep_size(root, skip=SHARED):
+    """
+    Approximate memory in bytes taken by root and everything it refers
+    to, following containers and instance attributes. Objects of the
+    `skip` types (other than root) are not followed.
+    """
+    seen = {id(root)}
+    pending = deque([root])
+    size = 0
+    while pending:
+        obj = pending.popleft()
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            children = [*obj.keys(), *obj.values()]
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            children = obj
+        else:
+            children = list(getattr(obj, '__dict__', {}).values())
+        for child in children:
+            if id(child) not in seen and not isinstance(child, skip):
+                seen.add(id(child))
+                pending.append(child)
+    return size
+
+
+def sampled_size(items):
+    """Approximate memory of a collection of records or notes."""
+    items = list(items)
+    if not items:
+        return 0
+    sample = random.sample(items, min(SAMPLE_SIZE, len(items)))
+    per_item = sum(deep_size(item) for item in sample) / len(sample)
+    return int(per_item * len(items))
+
+
+def collect_stats(address_book, notebook):
+    """
+    Returns a dictionary describing the loaded book: how many contacts,
+    notes and details it holds, approximate memory per structure in
+    bytes, the size of every index and how long loading and saving took.
+    """
+    records = list(address_book.data.values())
+    notes = list(notebook.data.values())
+    search_index = notebook.search_index
+    structures = {
+        'contacts': sampled_size(records) + sys.getsizeof(address_book.data),
+        'notes': sampled_size(notes) + sys.getsizeof(notebook.data),
+        'phone_index': deep_size(address_book.phone_index)
+        + deep_size(address_book._indexed_phones),
+        'phone_prefix_index': deep_size(address_book.phone_numbers),
+        'name_index': deep_size(address_book.names),
+        'title_index': deep_size(notebook.titles),
+        'birthday_index': deep_size(address_book.birthdays),
+        'email_index': deep_size(address_book.emails),
+        'address_index': deep_size(address_book.addresses),
+        'search_index': deep_size(search_index) if search_index else 0,
+    }
+    stats = {
+        'counts': {
+            'contacts': len(records),
+            'notes': len(notes),
+            'phones': sum(len(record.phones) for record in records),
+            'emails': sum(len(record.emails) for record in records),
+            'addresses': sum(len(record.addresses) for record in records),
+            'birthdays': sum(1 for record in records if record.birthday),
+            'revisions': sum(len(note.history) for note in notes),
+            'loaded_bodies': sum(1 for note in notes
+                                 if note._body is not None),
+        },
+        'indexes': {
+            'phone_index': len(address_book.phone_index),
+            'phone_prefix_index': len(address_book.phone_numbers),
+            'name_index': len(address_book.names),
+            'title_index': len(notebook.titles),
+            'birthday_index': len(address_book.birthdays),
+            'email_index': len(address_book.emails),
+            'address_index': len(address_book.addresses),
+            'search_index': len(search_index) if search_index else None,
+            'search_words': (len(search_index.document_count)
+                             if search_index else None),
+        },
+        'memory': dict(structures, total=sum(structures.values())),
+        'result_cache': {
+            name: {'entries': len(cache), 'hits': cache.hits,
+                   'misses': cache.misses}
+            for name, cache in (('contacts', address_book.results),
+                                ('notes', notebook.results))},
+        'timings': dict(address_book.timings),
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats['memory']['traced_current'] = current
+        stats['memory']['traced_peak'] = peak
+    return stats
+
+
+def collect_report(address_book, notebook, limit=REPORT_LIMIT):
+    """
+    Returns the aggregates kept up to date by the books' tallies: contact
+    details, birthdays per month, the most used tags and the authors
+    with the most notes (`limit` of each, all if None). Nothing is
+    scanned, so the cost does not grow with the size of the book.
+    """
+    contacts, notes = address_book.tally, notebook.tally
+    tags, authors = notes.grouped('tag'), notes.grouped('author')
+
+    def top(counts):
+        if limit is None:
+            return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        return heapq.nsmallest(limit, counts.items(),
+                               key=lambda item: (-item[1], item[0]))
+    return {
+        'contacts': {label: contacts[label] for label in (
+            'contacts', 'phones', 'emails', 'addresses', 'without phone',
+            'without email', 'without address', 'without birthday')},
+        'birthdays_per_month': {
+            calendar.month_name[month]: address_book.birthdays.per_month[month]
+            for month in range(1, 13)},
+        'notes': dict({label: notes[label] for label in (
+            'notes', 'untagged', 'revisions')},
+            **{'distinct tags': len(tags), 'authors': len(authors)}),
+        'tags': dict(top(tags)),
+        'authors': dict(top(authors)),
+    }
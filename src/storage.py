@@ -0,0 +1,343 @@
+import json
+import lzma
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Advisory locks are not available on Windows
+    fcntl = None
+
+# Seconds between background saves of unsaved changes
+AUTOSAVE_INTERVAL = float(os.environ.get('PERSONAL_ASSISTANT_AUTOSAVE', 30))
+
+
+@contextmanager
+def file_lock(filename):
+    """
+    Holds an exclusive advisory lock for the data file. The lock lives in
+    a separate '<filename>.lock' file so it survives the data file being
+    rewritten.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(filename + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_signature(filename):
+    """Returns (mtime, size) of the file or None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Body files are compacted once they grow past this size and are
+# mostly made of replaced note bodies
+COMPACT_MIN_BYTES = 1 << 20
+
+# Snapshot layout (all integers big-endian):
+#   header: magic, schema version, flags, file version, number of blocks
+#   blocks: name, codec, raw size, stored size, CRC32 of the raw bytes,
+#           followed by the stored (compressed) bytes
+# Every block holds a UTF-8 JSON document.
+MAGIC = b'PASNAP'
+SCHEMA_VERSION = 1
+HEADER = struct.Struct('>6sHHQI')
+BLOCK = struct.Struct('>4sBIII')
+
+# Header flags. Every field of a snapshot marked FLAG_VALIDATED passed
+# validation when it was written, and the CRC32 of every block proves it
+# has not changed since, so it can be loaded without validating again.
+FLAG_VALIDATED = 1
+
+CODEC_NONE, CODEC_ZLIB, CODEC_LZMA = 0, 1, 2
+COMPRESSORS = {
+    CODEC_NONE: (lambda raw: raw, lambda stored: stored),
+    CODEC_ZLIB: (zlib.compress, zlib.decompress),
+    CODEC_LZMA: (lzma.compress, lzma.decompress),
+}
+# Codec used for new snapshots: 'zlib' is faster, 'lzma' is smaller
+CODEC = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'lzma': CODEC_LZMA}[
+    os.environ.get('PERSONAL_ASSISTANT_CODEC', 'zlib')]
+
+
+class SnapshotError(ValueError):
+    """Raised when a data file is damaged or has an unknown format."""
+
+
+def migrate_pickle(data):
+    """
+    Schema 0 -> 1: pickle files kept notes as pickled Note objects.
+    Converts them to plain dictionaries.
+    """
+    notes = []
+    for note in data.get('notes', {}).values():
+        note_data = note.to_dict()
+        created_at = getattr(note, 'created_at', None)
+        note_data['created_at'] = (
+            created_at.isoformat() if created_at else None)
+        notes.append(note_data)
+    return {'contacts': data.get('contacts', []), 'notes': notes}
+
+
+# MIGRATIONS[n] upgrades data of schema n to schema n + 1
+MIGRATIONS = {
+    0: migrate_pickle,
+}
+
+
+def migrate(schema, data):
+    if schema > SCHEMA_VERSION:
+        raise SnapshotError(
+            f"The file was written by a newer version (schema {schema}).")
+    while schema < SCHEMA_VERSION:
+        data = MIGRATIONS[schema](data)
+        schema += 1
+    return data
+
+
+def read_header(file):
+    """Returns (schema, flags, version, blocks) or None for a legacy file."""
+    raw = file.read(HEADER.size)
+    if len(raw) < HEADER.size or not raw.startswith(MAGIC):
+        return None
+    return HEADER.unpack(raw)[1:]
+
+
+def read_legacy(file):
+    """
+    Reads a pickle file written before snapshots were introduced. Only
+    used once per old file: the next save rewrites it as a snapshot.
+    An empty file (made by touch or left by a crash of the old writer)
+    holds no data yet, like a missing one.
+    """
+    file.seek(0)
+    if not file.read(1):
+        return 0, {}
+    file.seek(0)
+    header = pickle.load(file)
+    if 'contacts' in header or 'notes' in header:
+        return 0, header  # A file without the version header
+    return header.get('version', 0), pickle.load(file)
+
+
+def read_version(filename):
+    """Reads only the header of the data file."""
+    try:
+        with open(filename, 'rb') as file:
+            header = read_header(file)
+            if header is None:
+                return read_legacy(file)[0]
+            return header[2]
+    except FileNotFoundError:
+        return 0
+
+
+def read_block(file):
+    raw_header = file.read(BLOCK.size)
+    if len(raw_header) < BLOCK.size:
+        raise SnapshotError("The data file is truncated.")
+    name, codec, raw_size, stored_size, checksum = BLOCK.unpack(raw_header)
+    stored = file.read(stored_size)
+    if len(stored) < stored_size or codec not in COMPRESSORS:
+        raise SnapshotError("The data file is damaged.")
+    try:
+        raw = COMPRESSORS[codec][1](stored)
+    except (zlib.error, lzma.LZMAError):
+        raise SnapshotError("The data file is damaged.")
+    if len(raw) != raw_size or zlib.crc32(raw) != checksum:
+        raise SnapshotError(
+            f"Checksum mismatch in the '{name.decode()}' block.")
+    return name.decode().strip(), raw
+
+
+def read_data_file(filename):
+    """
+    Returns (version, data) stored in the data file, where data is
+    {'contacts': [record dicts], 'notes': [note dicts], 'validated': bool}
+    migrated to the current schema.
+    """
+    with open(filename, 'rb') as file:
+        header = read_header(file)
+        if header is None:
+            version, data = read_legacy(file)
+            return version, dict(migrate(0, data), validated=False)
+        schema, flags, version, count = header
+        blocks = dict(read_block(file) for _ in range(count))
+    data = {name: json.loads(raw) for name, raw in blocks.items()}
+    data = migrate(schema, {
+        'contacts': data.get('CONT', []), 'notes': data.get('NOTE', [])})
+    # Migrated data was not written by this version: validate it
+    data['validated'] = bool(flags & FLAG_VALIDATED) \
+        and schema == SCHEMA_VERSION
+    return version, data
+
+
+def write_block(file, name, value):
+    raw = json.dumps(value, ensure_ascii=False,
+                     separators=(',', ':')).encode('utf-8')
+    stored = COMPRESSORS[CODEC][0](raw)
+    file.write(BLOCK.pack(name.encode().ljust(4), CODEC, len(raw),
+                          len(stored), zlib.crc32(raw)))
+    file.write(stored)
+
+
+def write_data_file(filename, version, data):
+    """
+    Writes the data file atomically: the data goes to a temporary file in
+    the same directory, is flushed to disk and then renamed over the old
+    file, so a crash never leaves a half-written file behind.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(
+        prefix=os.path.basename(filename) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            # Everything saved comes from validated fields
+            file.write(HEADER.pack(MAGIC, SCHEMA_VERSION, FLAG_VALIDATED,
+                                   version, 2))
+            write_block(file, 'CONT', data['contacts'])
+            write_block(file, 'NOTE', data['notes'])
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, filename)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class AutoSaver(threading.Thread):
+    """
+    A background thread that saves the address book and notebook every
+    `interval` seconds if they have unsaved changes.
+    """
+
+    def __init__(self, address_book, notebook, filename,
+                 interval=AUTOSAVE_INTERVAL):
+        super().__init__(name='autosave', daemon=True)
+        self.address_book = address_book
+        self.notebook = notebook
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        with self.address_book.lock:
+            if self.address_book.dirty or self.notebook.dirty:
+                self.address_book.save_to_disk(self.filename, self.notebook)
+
+    def stop(self):
+        """Stops the thread and saves what is left unsaved."""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+
+
+class BlobStore:
+    """
+    Note bodies kept out of the snapshot, in append-only files next to the
+    data file named '<filename>.notes.<generation>'. A body is addressed
+    by a reference [file name, offset, size] and read only when needed.
+    Once most of the bytes belong to replaced bodies, the live bodies are
+    copied into a new generation. The generation before it is kept for
+    sessions that have not reloaded yet; older ones are removed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.prefix = os.path.basename(filename) + '.notes.'
+        self.readers = {}  # File name -> open file
+
+    def generations(self):
+        return sorted(
+            int(name[len(self.prefix):]) for name in os.listdir(self.directory)
+            if name.startswith(self.prefix)
+            and name[len(self.prefix):].isdigit())
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, ref):
+        name, offset, size = ref
+        file = self.readers.get(name)
+        if file is None:
+            file = self.readers[name] = open(self.path(name), 'rb')
+        file.seek(offset)
+        return file.read(size).decode('utf-8')
+
+    def append(self, texts, generation=None):
+        """
+        Appends the texts to the newest generation file (or the given
+        one) and returns their references. The caller holds the data
+        file lock.
+        """
+        if generation is None:
+            generations = self.generations()
+            generation = generations[-1] if generations else 0
+        name = self.prefix + str(generation)
+        refs = []
+        with open(self.path(name), 'ab') as file:
+            offset = file.tell()
+            for text in texts:
+                data = text.encode('utf-8')
+                file.write(data)
+                refs.append([name, offset, len(data)])
+                offset += len(data)
+            file.flush()
+            os.fsync(file.fileno())
+        return refs
+
+    def compact(self, refs):
+        """
+        Returns new references for the live bodies `refs` if it was worth
+        rewriting them into a new generation, otherwise None.
+        """
+        generations = self.generations()
+        total = sum(os.path.getsize(self.path(self.prefix + str(generation)))
+                    for generation in generations)
+        live = sum(ref[2] for ref in refs)
+        if total < COMPACT_MIN_BYTES or total < 2 * live:
+            return None
+        new_refs = self.append([self.read(ref) for ref in refs],
+                               generations[-1] + 1)
+        for generation in generations[:-1]:
+            name = self.prefix + str(generation)
+            reader = self.readers.pop(name, None)
+            if reader is not None:
+                reader.close()
+            os.remove(self.path(name))
+        return new_refs
+
+
+class SyncState:
+    """
+    What this process last read from or wrote to the data file: the file
+    version and signature, and the contacts and notes as they were on
+    disk. Comparing against it tells external changes from local ones.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.version = 0
+        self.signature = None
+        self.contacts = {}
+        self.notes = {}
@@ -0,0 +1,73 @@
+from collections import Counter
+
+
+def note_tags(note):
+    """The tags of a note, whether they are kept as a list or as text."""
+    tags = note.tags.split(', ') if isinstance(note.tags, str) else note.tags
+    return [tag for tag in tags if tag]
+
+
+def contact_facts(record):
+    """What a contact adds to the address book's tally."""
+    return {
+        'contacts': 1,
+        'phones': len(record.phones),
+        'emails': len(record.emails),
+        'addresses': len(record.addresses),
+        'without phone': int(not record.phones),
+        'without email': int(not record.emails),
+        'without address': int(not record.addresses),
+        'without birthday': int(not record.birthday),
+    }
+
+
+def note_facts(note):
+    """What a note adds to the notebook's tally."""
+    tags = note_tags(note)
+    facts = Counter({'notes': 1, 'untagged': int(not tags),
+                     'revisions': len(note.history),
+                     ('author', note.author.value): 1})
+    facts.update(('tag', tag.lower()) for tag in tags)
+    return facts
+
+
+class Tally:
+    """
+    class for keeping counts over a whole book up to date
+
+    `facts` returns what one item adds to the counts, as a dictionary of
+    label -> number. The facts of every item are remembered, so adding,
+    changing or removing an item only moves its own counts, however
+    large the book is.
+    """
+
+    def __init__(self, facts):
+        self.facts = facts
+        self.counts = Counter()
+        self.counted = {}  # Key -> facts it was counted with
+
+    def __getitem__(self, label):
+        return self.counts[label]
+
+    def update(self, key, item):
+        facts = {label: number
+                 for label, number in self.facts(item).items() if number}
+        if self.counted.get(key) != facts:
+            self.remove(key)
+            self.counts.update(facts)
+            self.counted[key] = facts
+
+    def remove(self, key):
+        for label, number in self.counted.pop(key, {}).items():
+            self.counts[label] -= number
+            if not self.counts[label]:
+                del self.counts[label]
+
+    def clear(self):
+        self.counts.clear()
+        self.counted.clear()
+
+    def grouped(self, kind):
+        """Returns {value: count} for the labels (kind, value)."""
+        return {label[1]: number for label, number in self.counts.items()
+                if isinstance(label, tuple) and label[0] == kind}
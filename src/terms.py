@@ -0,0 +1,90 @@
+import re
+
+WORD = re.compile(r'\w+')
+
+
+def email_parts(value):
+    """Splits an email into its lowercase local part and domain."""
+    local, _, domain = value.lower().strip().rpartition('@')
+    return local, domain
+
+
+def address_words(value):
+    return WORD.findall(value.lower())
+
+
+def email_terms(record):
+    """
+    Terms a contact is filed under in the email index: the local part,
+    the domain and the whole address of every email, so that both parts
+    are only found together when they belong to the same address.
+    """
+    terms = set()
+    for email in record.emails:
+        local, domain = email_parts(email.value)
+        terms.add(('local', local))
+        terms.add(('domain', domain))
+        terms.add(('address', f"{local}@{domain}"))
+    return terms
+
+
+def address_terms(record):
+    """Terms a contact is filed under in the address index."""
+    return {word for address in record.addresses
+            for word in address_words(address.value)}
+
+
+class TermIndex:
+    """
+    class for finding contacts by the parts of one of their fields
+
+    `terms` returns the set of terms a record is filed under. Every term
+    maps to the records that have it, and the terms of every record are
+    remembered, so a changed contact only moves the terms that changed.
+    """
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.records = {}  # Term -> set of records
+        self.indexed = {}  # Record -> its terms
+
+    def __len__(self):
+        return len(self.records)
+
+    def update(self, record):
+        terms = self.terms(record)
+        indexed = self.indexed.get(record, set())
+        if terms == indexed:
+            return
+        self._drop(record, indexed - terms)
+        for term in terms - indexed:
+            self.records.setdefault(term, set()).add(record)
+        if terms:
+            self.indexed[record] = terms
+        else:
+            self.indexed.pop(record, None)
+
+    def remove(self, record):
+        self._drop(record, self.indexed.pop(record, ()))
+
+    def _drop(self, record, terms):
+        for term in terms:
+            owners = self.records[term]
+            owners.discard(record)
+            if not owners:
+                del self.records[term]
+
+    def clear(self):
+        self.records.clear()
+        self.indexed.clear()
+
+    def find(self, *terms):
+        """Returns the set of records filed under all the terms."""
+        found = sorted((self.records.get(term, set()) for term in terms),
+                       key=len)
+        if not found:
+            return set()
+        result = set(found[0])
+        for owners in found[1:]:
+            result &= owners
+        return result
@@ -0,0 +1,241 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from src.sorter import CATEGORY_FOLDERS, SortRun, process_file
+from src.sorter import process_folder, prune_folder
+
+# Seconds without new events before a batch of files is sorted
+DEBOUNCE = 1.0
+# A batch is sorted after this many seconds even if events keep coming
+MAX_DELAY = 10.0
+# Seconds between directory scans when inotify is not available
+POLL_INTERVAL = 2.0
+# Files that are still being downloaded or written under another name
+PARTIAL_SUFFIXES = ('.part', '.crdownload', '.download', '.tmp', '.partial')
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    class for waiting on changes to a folder with Linux inotify
+
+    The kernel reports a file once it is closed after writing or moved in,
+    so a file is never seen half-written, and nothing runs while the
+    folder is quiet: wait() sleeps in select() until there is an event.
+    """
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, os.strerror(error), folder)
+        self.folder = folder
+        # Written to by wake() to stop a thread waiting in wait()
+        self.wake_read, self.wake_write = os.pipe()
+
+    def wait(self, timeout=None):
+        """
+        Waits up to `timeout` seconds (forever if None) and returns the
+        set of names in the folder that changed, empty on timeout.
+        """
+        ready, _, _ = select.select([self.fd, self.wake_read], [], [],
+                                    timeout)
+        if self.fd not in ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: look at everything once
+                return set(os.listdir(self.folder))
+            if mask & IN_CREATE and not mask & IN_ISDIR:
+                continue  # Wait for the file to be closed
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def wake(self):
+        os.write(self.wake_write, b'x')
+
+    def close(self):
+        for fd in (self.fd, self.wake_read, self.wake_write):
+            os.close(fd)
+
+
+class PollingWatcher:
+    """
+    class for finding changes to a folder where inotify is not available
+
+    Every POLL_INTERVAL seconds the folder's entries are listed with their
+    size and modification time, without reading the files or descending
+    into subfolders. A file that is still growing keeps showing up as
+    changed, which postpones sorting it until it stops.
+    """
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.seen = self.scan()
+
+    def scan(self):
+        entries = {}
+        with os.scandir(self.folder) as items:
+            for entry in items:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return entries
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.stopped.is_set():
+            delay = self.interval if deadline is None \
+                else min(self.interval, max(deadline - time.monotonic(), 0))
+            if self.stopped.wait(delay):
+                break
+            current = self.scan()
+            names = {name for name, signature in current.items()
+                     if self.seen.get(name) != signature}
+            self.seen = current
+            if names:
+                return names
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return set()
+
+    def wake(self):
+        self.stopped.set()
+
+    def close(self):
+        pass
+
+
+def make_watcher(folder):
+    """Returns an InotifyWatcher if the system has inotify, else polling."""
+    try:
+        return InotifyWatcher(folder)
+    except (OSError, AttributeError):
+        return PollingWatcher(folder)
+
+
+def signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FolderWatcher(threading.Thread):
+    """
+    A background thread that keeps a folder sorted: new files are
+    collected until the folder has been quiet for DEBOUNCE seconds, then
+    sorted in one batch with the same categories as 'sort folder'.
+    """
+
+    def __init__(self, source_folder, report=print, debounce=DEBOUNCE):
+        super().__init__(name='watch folder', daemon=True)
+        self.source_folder = source_folder
+        self.report = report
+        self.debounce = debounce
+        self.watcher = make_watcher(source_folder)
+        self.stopped = threading.Event()
+        self.sorted_count = 0
+
+    def run(self):
+        pending = {}  # Name -> (size, mtime) when it last changed
+        first_seen = None
+        while not self.stopped.is_set():
+            names = self.watcher.wait(self.debounce if pending else None)
+            if self.stopped.is_set():
+                break
+            for name in names:
+                if name in CATEGORY_FOLDERS \
+                        or name.endswith(PARTIAL_SUFFIXES) \
+                        or name.startswith('.'):
+                    continue
+                pending[name] = signature(
+                    os.path.join(self.source_folder, name))
+            if not pending:
+                continue
+            first_seen = first_seen or time.monotonic()
+            if names and time.monotonic() - first_seen < MAX_DELAY:
+                continue  # Still busy: wait until it calms down
+            pending = self.sort_batch(pending)
+            first_seen = time.monotonic() if pending else None
+
+    def sort_batch(self, pending):
+        """Sorts the settled entries and returns the ones still changing."""
+        still_changing = {}
+        moved = []
+        run = SortRun()
+        # Only the folders sorted in this batch can have been left empty
+        sorted_folders = []
+        for name, seen in pending.items():
+            path = os.path.join(self.source_folder, name)
+            now = signature(path)
+            if now is None:
+                continue  # Gone already
+            if now != seen:
+                still_changing[name] = now
+                continue
+            try:
+                if os.path.isdir(path):
+                    sorted_folders.append(path)
+                    process_folder(path, self.source_folder, run)
+                    moved.append(f"{name}/")
+                elif os.path.isfile(path):
+                    processor = process_file(
+                        name, path, self.source_folder, run)
+                    moved.append(
+                        f"{name} -> {processor.__name__[len('process_'):]}")
+            except OSError as e:
+                self.report(f"Could not sort {name}: {e}")
+        for path in sorted_folders:
+            try:
+                prune_folder(path)
+            except OSError as e:
+                self.report(f"Could not remove {path}: {e}")
+        for message in run.skipped:
+            self.report(message)
+        if moved:
+            self.sorted_count += len(moved)
+            self.report(f"Sorted {len(moved)} new items in "
+                        f"{self.source_folder}: {', '.join(moved)}")
+        return still_changing
+
+    def stop(self):
+        self.stopped.set()
+        self.watcher.wake()
+        if self.is_alive():
+            self.join()
+        self.watcher.close()